@@ -0,0 +1,43 @@
+"""
+    Startup cost of atom interning, serial versus pipelined.
+
+    Run it against the display you want to measure, e.g. an ssh forwarded
+    one or a local server behind a throttled link (tc qdisc ... netem delay);
+    the difference grows with the latency of the connection.
+
+    Usage: DISPLAY=... python -m orion.bench.atoms
+"""
+import os, time
+import xcb, xcb.xcb, xcb.xproto
+from orion.comm.xorg.atom import AtomCache
+from orion.utils import pack
+
+
+def serial(conn, names):
+    start = time.time()
+    for name in names:
+        conn.core.InternAtom(False, len(name), name).reply()
+    return len(names), time.time() - start
+
+
+def pipelined(conn, names):
+    cache = AtomCache.__new__(AtomCache)
+    cache.conn = pack(conn=conn)
+    cache.atoms, cache.reverse, cache.round_trips = {}, {}, 0
+    start = time.time()
+    cache.intern_many(names)
+    return cache.round_trips, time.time() - start
+
+
+def main():
+    conn = xcb.xcb.connect(display=os.environ.get("DISPLAY"))
+    names = AtomCache.preload_names()
+    for label, f in (('serial', serial), ('pipelined', pipelined)):
+        trips, elapsed = f(conn, names)
+        print '%-10s %3d atoms, %3d round trips, %8.2f ms'%(
+            label, len(names), trips, elapsed*1000)
+    conn.disconnect()
+
+
+if __name__ == '__main__':
+    main()
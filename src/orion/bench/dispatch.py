@@ -0,0 +1,133 @@
+"""
+    Microbenchmark of X event dispatch.
+
+    Compares the old xpoll dispatch (class name lookup, hasattr probes and an
+    if/elif chain of string comparisons) with the table driven
+    EventDispatcher. Both variants feed the same sink, so only the dispatch
+    cost is measured. Debug prints of the old code are not reproduced.
+
+    Usage: python -m orion.bench.dispatch [events]
+"""
+import sys, time
+from orion.comm.xorg import dispatch
+
+
+class _Event(object):
+    def __init__(self, response_type, **kwargs):
+        self.response_type = response_type
+        self.__dict__.update(kwargs)
+
+class PropertyNotifyEvent(_Event): pass
+class ConfigureNotifyEvent(_Event): pass
+class EnterNotifyEvent(_Event): pass
+
+
+def make_events(n):
+    """
+        A PropertyNotify/ConfigureNotify storm with some crossing events.
+    """
+    l = []
+    for i in xrange(n):
+        k = i % 10
+        if k < 5:
+            l.append(PropertyNotifyEvent(dispatch.PropertyNotify, window=i%50, atom=39))
+        elif k < 9:
+            l.append(ConfigureNotifyEvent(dispatch.ConfigureNotify, window=i%50))
+        else:
+            l.append(EnterNotifyEvent(dispatch.EnterNotify, event=i%50))
+    return l
+
+
+class _Sink(object):
+    def __init__(self):
+        self.count = 0
+    def __call__(self, target, **kwargs):
+        self.count += 1
+
+
+def legacy_dispatch(events, sink):
+    eventEvents = [
+        "EnterNotifyEvent",
+        "ButtonPressEvent",
+        "ButtonReleaseEvent",
+        "KeyPressEvent",
+    ]
+    for e in events:
+        e.name = e.__class__.__name__
+        window = None
+        if hasattr(e, "window"):
+            window = e.window
+        elif hasattr(e, "drawable"):
+            window = e.drawable
+        elif e.name in eventEvents:
+            window = e.event
+
+        if e.name == 'KeyPressEvent':
+            sink(None, wid=None)
+        elif e.name == 'KeyReleaseEvent':
+            sink(None, wid=None)
+        elif e.name == 'CreateNotifyEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'DestroyNotifyEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'ClientMessageEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'ConfigureRequestEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'MapRequestEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'PropertyNotifyEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'ConfigureNotifyEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'MapNotifyEvent':
+            sink(None, wid=e.window)
+        elif e.name == 'LeaveNotifyEvent':
+            sink(None, wid=e.event)
+        elif e.name == 'FocusInEvent':
+            sink(None, wid=e.event)
+        elif e.name == 'FocusOutEvent':
+            sink(None, wid=e.event)
+        elif e.name == 'EnterNotifyEvent':
+            sink(None, wid=e.event)
+
+
+def table_dispatch(events, sink):
+    d = dispatch.EventDispatcher()
+    def window_handler(e):
+        sink(None, wid=e.window)
+    def event_handler(e):
+        sink(None, wid=e.event)
+    for code in (dispatch.CreateNotify, dispatch.DestroyNotify,
+                 dispatch.ClientMessage, dispatch.ConfigureRequest,
+                 dispatch.MapRequest, dispatch.PropertyNotify,
+                 dispatch.ConfigureNotify, dispatch.MapNotify):
+        d.register(code, window_handler)
+    for code in (dispatch.LeaveNotify, dispatch.FocusIn,
+                 dispatch.FocusOut, dispatch.EnterNotify):
+        d.register(code, event_handler)
+    handle = d.dispatch
+    for e in events:
+        handle(e)
+
+
+def measure(f, events):
+    sink = _Sink()
+    start = time.time()
+    f(events, sink)
+    elapsed = time.time() - start
+    assert sink.count == len(events)
+    return len(events) / elapsed
+
+
+def main(n=200000):
+    events = make_events(n)
+    before = measure(legacy_dispatch, events)
+    after = measure(table_dispatch, events)
+    print 'if/elif dispatch: %10d events/s'%before
+    print 'table dispatch:   %10d events/s'%after
+    print 'speedup:          %10.2fx'%(after/before)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
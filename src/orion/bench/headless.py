@@ -0,0 +1,61 @@
+"""
+    Scaling benchmark of the window manager against the headless display.
+
+    orion is started on the in-memory display (ORION_DISPLAY_SERVER=headless),
+    then simulated applications map windows in batches, spread over the
+    groups, and finally every group is shown once. Each phase reports the
+    wall time, the requests sent and the round trips paid; with a simulated
+    latency (ORION_HEADLESS_LATENCY, in seconds) the round trips dominate.
+
+    Usage: python -m orion.bench.headless [windows [groups [batch]]]
+"""
+import os, sys, time
+
+
+def report(label, server, start, before):
+    elapsed = time.time() - start
+    after = server.stats()
+    print '%-10s %8d requests %8d round trips %10.3f s'%(
+        label,
+        after['requests'] - before['requests'],
+        after['round_trips'] - before['round_trips'],
+        elapsed,
+    )
+
+
+def main(windows=10000, groups=50, batch=100):
+    os.environ['ORION_DISPLAY_SERVER'] = 'headless'
+    import orion
+    from orion.wm.nebula.manager import Group
+    orion.init()
+    conn = orion.conn
+    server = conn.server
+    wm = orion.window_manager
+    screen = wm.currentScreen
+
+    for i in range(groups):
+        g = Group('bench-%s'%i)
+        g._configure(wm.config.layouts, wm.config.floating_layout, wm)
+        wm.groups.append(g)
+        wm.groupMap[g.name] = g
+    bench_groups = wm.groups[-groups:]
+
+    before, start = server.stats(), time.time()
+    for i in range(0, windows, batch):
+        screen.setGroup(bench_groups[(i // batch) % groups])
+        for j in range(min(batch, windows - i)):
+            server.create_client(name='client-%s'%(i + j))
+        conn.xpoll()
+    report('manage', server, start, before)
+
+    before, start = server.stats(), time.time()
+    for g in bench_groups:
+        screen.setGroup(g)
+        conn.xpoll()
+    report('switch', server, start, before)
+
+    print 'managed: %d windows in %d groups'%(len(wm.windowMap), groups)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
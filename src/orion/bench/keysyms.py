@@ -0,0 +1,74 @@
+"""
+    Startup cost of the keysym database.
+
+    Compares importing a dict literal of all keysyms (how the table used to
+    be shipped) with importing the lazy database and with its first lookup.
+    Every case runs in a fresh interpreter; the import time and the growth
+    of the resident set are reported.
+
+    Usage: python -m orion.bench.keysyms
+"""
+import os, sys, shutil, tempfile, subprocess
+
+KEYBOARD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'comm', 'xorg', 'keyboard')
+
+PROBE = """
+import sys, time
+sys.path.insert(0, %(path)r)
+def rss():
+    return int(open('/proc/self/statm').read().split()[1]) * 4096
+m0, t0 = rss(), time.time()
+%(code)s
+print time.time() - t0, rss() - m0
+"""
+
+CASES = [
+    ('dict literal', 'import xkeysyms_eager'),
+    ('lazy import', 'import keysymdb'),
+    ('first lookup', 'import keysymdb; keysymdb.keysyms["Return"]; keysymdb.keysyms.name(0xff0d)'),
+]
+
+
+def eager_source():
+    """
+        Recreate the old dict literal module from the database.
+    """
+    sys.path.insert(0, KEYBOARD)
+    import keysymdb, keysymdef
+    lines = ['keysyms = {']
+    for line in keysymdef.DATA.splitlines():
+        name, value = line.split()
+        lines.append("    '%s': 0x%s,"%(name, value))
+    for mask in range(1, 256):
+        name = keysymdb.keysyms.name(keysymdb.BRAILLE + mask)
+        lines.append("    '%s': 0x%x,"%(name, keysymdb.BRAILLE + mask))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def probe(path, code):
+    # the first run compiles the .pyc, measure the second one
+    for i in range(2):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       PROBE%dict(path=path, code=code)])
+    t, m = out.split()
+    return float(t), int(m)
+
+
+def main():
+    tmp = tempfile.mkdtemp()
+    try:
+        for name in ('keysymdb.py', 'keysymdef.py'):
+            shutil.copy(os.path.join(KEYBOARD, name), tmp)
+        with open(os.path.join(tmp, 'xkeysyms_eager.py'), 'w') as f:
+            f.write(eager_source())
+        for label, code in CASES:
+            t, m = probe(tmp, code)
+            print '%-14s %8.2f ms %8d KiB'%(label, t * 1000, m / 1024)
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+    Wakeups and dispatch latency of the main loop backends.
+
+    Each loop watches a pipe standing in for the X connection; every byte
+    written to it is one event. A writer thread sends events at a fixed
+    interval, then stays silent for a while, so the report shows the
+    latency from write to dispatch, the number of wakeups per event and
+    the wakeups which happened while there was nothing to do.
+
+    Usage: python -m orion.bench.loops [events [interval_ms [idle_s]]]
+"""
+import os, sys, time, fcntl, errno, threading
+from collections import deque
+from pyutilib.component.core import ExtensionPoint
+from orion.utils import pack
+from orion.loop.api import IEventLoop
+from orion.loop import gobjectloop
+try:
+    from orion.loop import asyncioloop
+except ImportError:
+    asyncioloop = None
+
+
+class PipeDisplay(object):
+    """
+        Stands in for Xorg in the loops: xpoll reads the pending bytes of
+        the pipe as events.
+    """
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.conn = pack(get_file_descriptor=lambda: self.read_fd)
+        self.sent = deque()
+        self.latencies = []
+        self.last_drain = 0
+        self.loop = None
+
+    def send(self, quit=False):
+        self.sent.append(time.time())
+        os.write(self.write_fd, 'q' if quit else 'e')
+
+    def xpoll(self, conn=None, cond=None):
+        try:
+            data = os.read(self.read_fd, 4096)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            data = ''
+        now = time.time()
+        for c in data:
+            t = self.sent.popleft()
+            if c == 'q':
+                self.loop.stop()
+            else:
+                self.latencies.append(now - t)
+        self.last_drain = len(data)
+        return True
+
+    def end_cycle(self):
+        pass
+
+
+def writer(display, loop, events, interval, idle, marks):
+    time.sleep(0.1)
+    for i in range(events):
+        display.send()
+        time.sleep(interval)
+    marks['idle'] = loop.wakeups
+    time.sleep(idle)
+    marks['end'] = loop.wakeups
+    display.send(quit=True)
+
+
+def measure(loop, events, interval, idle):
+    display = PipeDisplay()
+    display.loop = loop
+    before = loop.stats()
+    marks = {}
+    loop.init(display)
+    t = threading.Thread(target=writer,
+                         args=(display, loop, events, interval, idle, marks))
+    t.start()
+    loop.run()
+    t.join()
+    after = loop.stats()
+
+    l = sorted(display.latencies)
+    print '%-8s latency median %8.1f us, p99 %8.1f us, max %8.1f us'%(
+        loop.name,
+        l[len(l) // 2] * 1e6,
+        l[int(len(l) * 0.99)] * 1e6,
+        l[-1] * 1e6,
+    )
+    print '%-8s %d events, %d wakeups, %d idle wakeups, %d wakeups while idle'%(
+        '',
+        after['events'] - before['events'],
+        after['wakeups'] - before['wakeups'],
+        after['idle_wakeups'] - before['idle_wakeups'],
+        marks['end'] - marks['idle'],
+    )
+
+
+def main(events=1000, interval_ms=2, idle=2):
+    loops = ExtensionPoint(IEventLoop)
+    names = ['gobject']
+    if asyncioloop is not None:
+        names.append('asyncio')
+    for name in names:
+        if name == 'gobject':
+            import gobject
+            gobject.threads_init()
+        measure(loops.service(name), events, interval_ms / 1000.0, idle)
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
@@ -0,0 +1,37 @@
+"""
+    Replay a recorded session through the event dispatch path at full speed.
+
+    Record a session by running orion with ORION_RECORD=path, then feed it
+    back with this script. The whole of orion (Xorg, Nebula, groups and
+    layouts) runs against the recording, so the throughput can be compared
+    across versions.
+
+    Usage: python -m orion.bench.replay path
+"""
+import os, sys, time
+
+
+def main(path):
+    os.environ['ORION_REPLAY'] = path
+    import orion
+    orion.init()
+    conn = orion.conn
+    replay = conn.conn.replay
+
+    drains = 0
+    start = time.time()
+    while conn.conn.next_drain():
+        conn.xpoll()
+        drains += 1
+    elapsed = time.time() - start
+
+    print 'drains:           %10d'%drains
+    print 'events:           %10d'%replay.events
+    print 'requests:         %10d'%replay.requests
+    print 'missing replies:  %10d'%replay.missing
+    print 'elapsed:          %10.3f s'%elapsed
+    print 'throughput:       %10d events/s'%(replay.events / max(elapsed, 1e-9))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
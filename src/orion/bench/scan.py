@@ -0,0 +1,70 @@
+"""
+    Adoption of pre-existing windows (Nebula.scan) on the headless display.
+
+    Creates windows which are already mapped, as they are when the window
+    manager restarts, and adopts them with the serial scan orion used to
+    do and with the pipelined one. Each run adopts a fresh set of windows.
+    The simulated round trip time defaults to 0.2 ms
+    (ORION_HEADLESS_LATENCY).
+
+    Usage: python -m orion.bench.scan [windows]
+"""
+import os, sys, time
+import xcb.xproto
+
+
+def serial_scan(wm):
+    from orion.wm.window import window
+    _, _, children = wm.root.query_tree()
+    for item in children:
+        try:
+            attrs = item.get_attributes()
+            state = item.get_wm_state()
+        except (xcb.xproto.BadWindow, xcb.xproto.BadAccess):
+            continue
+        if attrs and attrs.map_state == xcb.xproto.MapState.Unmapped:
+            continue
+        if state and state[0] == window.wmState.WITHDRAWN:
+            continue
+        wm.manage(item)
+
+
+def existing_windows(server, n):
+    """
+        Replace the children of the root by n mapped client windows.
+    """
+    server.root.children = []
+    for i in range(n):
+        wid = server.create_client(name='client-%s'%i, map=False)
+        w = server.windows[wid]
+        w.mapped = True
+        server.client_set_property(wid, 'WM_STATE', 'WM_STATE', 32, '\x01\0\0\0\0\0\0\0')
+    server.events.clear()
+
+
+def main(windows=1000):
+    os.environ['ORION_DISPLAY_SERVER'] = 'headless'
+    os.environ.setdefault('ORION_HEADLESS_LATENCY', '0.0002')
+    import orion
+    orion.init()
+    conn = orion.conn
+    server = conn.server
+    wm = orion.window_manager
+
+    for label, scan in (('serial', serial_scan), ('pipelined', type(wm).scan)):
+        existing_windows(server, windows)
+        before, start = server.stats(), time.time()
+        scan(wm)
+        conn.end_cycle()
+        elapsed = time.time() - start
+        after = server.stats()
+        print '%-10s %5d windows %8d requests %8d round trips %8.3f s'%(
+            label, windows,
+            after['requests'] - before['requests'],
+            after['round_trips'] - before['round_trips'],
+            elapsed,
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(i) for i in sys.argv[1:]])
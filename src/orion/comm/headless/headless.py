@@ -0,0 +1,42 @@
+from pyutilib.component.core import implements
+from orion.comm.api import IDisplayServerCommunicator
+from orion.comm.xorg.xorg import Xorg
+from server import Server, HeadlessConnection
+
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Headless(Xorg):
+    """
+        A display server communicator which talks to an in-memory model of an
+        X server (see server.Server) instead of a real display, so the window
+        manager can be run and benchmarked in-process and deterministically.
+
+        Select it with ORION_DISPLAY_SERVER=headless. ORION_HEADLESS_LATENCY
+        sets the simulated round trip time in seconds and ORION_HEADLESS_SIZE
+        the screen size as WIDTHxHEIGHT.
+    """
+    implements(IDisplayServerCommunicator)
+
+    def __init__(self):
+        Xorg.__init__(self)
+        self.name = 'headless'
+        self.server = None
+
+    def connect(self, display):
+        width, height = os.environ.get('ORION_HEADLESS_SIZE', '1920x1080').split('x')
+        self.server = Server(
+            width = int(width),
+            height = int(height),
+            latency = float(os.environ.get('ORION_HEADLESS_LATENCY', 0)),
+        )
+        logger.debug('headless display %sx%s'%(width, height))
+        return HeadlessConnection(self.server)
+
+    def stats(self):
+        """
+            Return the request, round trip and flush counters of the server.
+        """
+        return self.server.stats()
@@ -0,0 +1,639 @@
+"""
+    An in-memory model of an X server, exposed through an object which
+    quacks like an xpyb connection.
+
+    Windows, their properties, attributes and geometry, atoms and the event
+    queue live in a Server. Requests made through HeadlessConnection.core are
+    executed immediately, but their replies are only "received" after a
+    simulated round trip: reading the reply of a request which was sent
+    after the last round trip costs one round trip (and optionally latency),
+    while replies of requests sent together are read for free, just like
+    pipelined requests on a real connection.
+"""
+import struct, time
+from collections import deque
+import xcb, xcb.xproto
+from xcb.xproto import CW, ConfigWindow, EventMask, MapState
+from orion.utils import pack
+from orion.comm.xorg import dispatch
+from orion.comm.xorg.keyboard import keysyms
+
+import logging
+logger = logging.getLogger(__name__)
+
+ROOT = 0x100
+FIRST_ID = 0x00200000
+FIRST_ATOM = 69
+
+# (lower, upper) keysym names of the modelled keyboard, from keycode 8 on
+KEYS = [(c, c.upper()) for c in 'abcdefghijklmnopqrstuvwxyz'] + \
+       [(c, c) for c in '0123456789'] + \
+       [(k, k) for k in ('Return', 'Escape', 'Tab', 'space', 'BackSpace',
+                         'Left', 'Right', 'Up', 'Down')] + \
+       [('F%s'%i, 'F%s'%i) for i in range(1, 13)] + \
+       [(k, k) for k in ('Shift_L', 'Caps_Lock', 'Control_L', 'Alt_L',
+                         'Num_Lock', 'Super_L')]
+
+# modifier -> keysym names, in modmask order
+MODIFIERS = [
+    ('Shift_L',),
+    ('Caps_Lock',),
+    ('Control_L',),
+    ('Alt_L',),
+    ('Num_Lock',),
+    (),
+    ('Super_L',),
+    (),
+]
+
+CW_ORDER = [CW.BackPixmap, CW.BackPixel, CW.BorderPixmap, CW.BorderPixel,
+            CW.BitGravity, CW.WinGravity, CW.BackingStore, CW.BackingPlanes,
+            CW.BackingPixel, CW.OverrideRedirect, CW.SaveUnder, CW.EventMask,
+            CW.DontPropagate, CW.Colormap, CW.Cursor]
+
+CONFIG_ORDER = [ConfigWindow.X, ConfigWindow.Y, ConfigWindow.Width,
+                ConfigWindow.Height, ConfigWindow.BorderWidth,
+                ConfigWindow.Sibling, ConfigWindow.StackMode]
+
+
+def _unmask(mask, order, values):
+    """
+        Pair the set bits of a value mask with their values.
+    """
+    d = {}
+    values = iter(values)
+    for bit in order:
+        if mask & bit:
+            d[bit] = values.next()
+    return d
+
+
+class HeadlessEvent(object):
+    """
+        An event with the attributes of the matching xpyb event.
+    """
+    def __init__(self, response_type, **kwargs):
+        self.response_type = response_type
+        self.__dict__.update(kwargs)
+
+
+class PropertyValue(object):
+    """
+        The value of a GetProperty reply: a sequence of byte values with
+        buf() returning the raw string, as in xpyb.
+    """
+    def __init__(self, data):
+        self.data = data
+
+    def buf(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return (ord(c) for c in self.data)
+
+
+class HeadlessWindow(object):
+    def __init__(self, wid, parent, x, y, width, height, border_width=0,
+                 override_redirect=False):
+        self.wid = wid
+        self.parent = parent
+        self.children = []
+        self.x, self.y, self.width, self.height = x, y, width, height
+        self.border_width = border_width
+        self.border_pixel = 0
+        self.override_redirect = override_redirect
+        self.event_mask = 0
+        self.mapped = False
+        # atom -> (type, format, data)
+        self.properties = {}
+
+
+class _Cookie(object):
+    def __init__(self, server, sequence, value=None, error=None):
+        self.server = server
+        self.sequence = sequence
+        self.value = value
+        self.error = error
+
+    def reply(self):
+        self.server.wait(self.sequence)
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def check(self):
+        self.reply()
+
+
+class Server(object):
+    """
+        The state of the modelled display.
+
+        latency is the simulated round trip time in seconds. requests,
+        round_trips, flushes and per_request count what the window manager
+        did to the server.
+    """
+    def __init__(self, width=1920, height=1080, latency=0.0):
+        self.latency = latency
+        self.width, self.height = width, height
+        self.windows = {}
+        self.events = deque()
+        self.next_id = FIRST_ID
+        self.atoms = {}
+        self.atom_names = {}
+        for name in dir(xcb.xproto.Atom):
+            if not name.startswith("_"):
+                atom = getattr(xcb.xproto.Atom, name)
+                self.atoms[name] = atom
+                self.atom_names[atom] = name
+        self.next_atom = FIRST_ATOM
+        self.focus = ROOT
+        self.grabs = set()
+
+        self.sequence = 0
+        self.synced = 0
+        self.requests = 0
+        self.round_trips = 0
+        self.flushes = 0
+        self.errors = 0
+        self.per_request = {}
+
+        root = HeadlessWindow(ROOT, None, 0, 0, width, height)
+        root.mapped = True
+        self.windows[ROOT] = root
+        self.root = root
+
+        self.keysyms_per_keycode = 2
+        self.min_keycode = 8
+        self.max_keycode = 255
+        self.keycodes = {}
+        self.keymap = [0] * ((self.max_keycode + 1) * self.keysyms_per_keycode)
+        for i, (lower, upper) in enumerate(KEYS):
+            code = self.min_keycode + i
+            self.keycodes[lower] = code
+            self.keymap[code*2] = keysyms[lower]
+            self.keymap[code*2+1] = keysyms[upper]
+
+    #### bookkeeping
+
+    def request(self, name):
+        self.sequence += 1
+        self.requests += 1
+        self.per_request[name] = self.per_request.get(name, 0) + 1
+        return self.sequence
+
+    def wait(self, sequence):
+        """
+            Wait for the reply of request sequence.
+        """
+        if sequence > self.synced:
+            self.round_trips += 1
+            self.synced = self.sequence
+            if self.latency:
+                time.sleep(self.latency)
+
+    def stats(self):
+        return dict(
+            requests = self.requests,
+            round_trips = self.round_trips,
+            flushes = self.flushes,
+            errors = self.errors,
+            windows = len(self.windows) - 1,
+        )
+
+    def bad_window(self, wid):
+        self.errors += 1
+        return xcb.xproto.BadWindow(pack(bad_value=wid, sequence=self.sequence))
+
+    def intern(self, name):
+        atom = self.atoms.get(name)
+        if atom is None:
+            atom = self.next_atom
+            self.next_atom += 1
+            self.atoms[name] = atom
+            self.atom_names[atom] = name
+        return atom
+
+    def generate_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    #### events
+
+    def queue(self, response_type, **kwargs):
+        self.events.append(HeadlessEvent(response_type,
+            sequence=self.sequence & 0xffff, **kwargs))
+
+    def notify(self, w, response_type, **kwargs):
+        """
+            Queue a structure event for everybody who selected it on w or its
+            parent.
+        """
+        if w.event_mask & EventMask.StructureNotify:
+            self.queue(response_type, event=w.wid, window=w.wid, **kwargs)
+        parent = self.windows.get(w.parent)
+        if parent is not None and parent.event_mask & EventMask.SubstructureNotify:
+            self.queue(response_type, event=parent.wid, window=w.wid, **kwargs)
+
+    def configure_notify(self, w):
+        self.notify(w, dispatch.ConfigureNotify,
+            above_sibling = 0,
+            x = w.x, y = w.y, width = w.width, height = w.height,
+            border_width = w.border_width,
+            override_redirect = w.override_redirect,
+        )
+
+    def property_notify(self, w, atom, deleted=False):
+        if w.event_mask & EventMask.PropertyChange:
+            self.queue(dispatch.PropertyNotify,
+                window = w.wid,
+                atom = atom,
+                time = 0,
+                state = 1 if deleted else 0,
+            )
+
+    #### the client side, used to simulate applications
+
+    def create_client(self, x=0, y=0, width=640, height=480, name=None,
+                      override_redirect=False, map=True):
+        """
+            Create a top level window as an application would, and map it.
+            Returns the window id.
+        """
+        wid = self.generate_id()
+        w = HeadlessWindow(wid, ROOT, x, y, width, height,
+                           override_redirect=override_redirect)
+        self.windows[wid] = w
+        self.root.children.append(wid)
+        self.notify(w, dispatch.CreateNotify,
+            parent = ROOT,
+            x = x, y = y, width = width, height = height,
+            border_width = 0,
+            override_redirect = override_redirect,
+        )
+        if name is not None:
+            self.client_set_property(wid, 'WM_NAME', 'STRING', 8, name)
+        if map:
+            self.client_map(wid)
+        return wid
+
+    def client_map(self, wid):
+        w = self.windows[wid]
+        if not w.override_redirect and \
+                self.root.event_mask & EventMask.SubstructureRedirect:
+            self.queue(dispatch.MapRequest, parent=w.parent, window=wid)
+        else:
+            self.map(w)
+
+    def client_set_property(self, wid, name, type, format, data):
+        w = self.windows[wid]
+        atom = self.intern(name)
+        w.properties[atom] = (self.intern(type), format, data)
+        self.property_notify(w, atom)
+
+    def client_destroy(self, wid):
+        w = self.windows.pop(wid)
+        parent = self.windows.get(w.parent)
+        if parent is not None:
+            parent.children.remove(wid)
+        self.notify(w, dispatch.DestroyNotify)
+
+    #### server side operations
+
+    def map(self, w):
+        if not w.mapped:
+            w.mapped = True
+            self.notify(w, dispatch.MapNotify,
+                        override_redirect=w.override_redirect)
+
+    def unmap(self, w):
+        if w.mapped:
+            w.mapped = False
+            self.notify(w, dispatch.UnmapNotify, from_configure=False)
+
+
+class HeadlessCore(object):
+    """
+        The core protocol requests of a HeadlessConnection. Requests which
+        are not modelled are accepted and counted, but have no effect.
+    """
+    def __init__(self, server):
+        self.server = server
+        # set while a *Checked request runs
+        self.checked = False
+
+    def __getattr__(self, name):
+        if name.endswith('Checked'):
+            request = getattr(self, name[:-len('Checked')])
+            def checked(*args):
+                self.checked = True
+                try:
+                    return request(*args)
+                finally:
+                    self.checked = False
+            return checked
+        server = self.server
+        def request(*args):
+            return _Cookie(server, server.request(name))
+        return request
+
+    def _window(self, name, wid, void=False):
+        """
+            Look up the window of a request. Errors of unchecked requests
+            without a reply are delivered through the event queue.
+        """
+        s = self.server
+        seq = s.request(name)
+        w = s.windows.get(wid)
+        if w is None:
+            error = s.bad_window(wid)
+            if void and not self.checked:
+                s.events.append(error)
+                return seq, None, _Cookie(s, seq)
+            return seq, None, _Cookie(s, seq, error=error)
+        return seq, w, None
+
+    def InternAtom(self, only_if_exists, name_len, name):
+        s = self.server
+        seq = s.request('InternAtom')
+        if only_if_exists and name not in s.atoms:
+            return _Cookie(s, seq, pack(atom=0))
+        return _Cookie(s, seq, pack(atom=s.intern(name)))
+
+    def GetAtomName(self, atom):
+        s = self.server
+        name = s.atom_names.get(atom, '')
+        return _Cookie(s, s.request('GetAtomName'),
+                       pack(name=PropertyValue(name), name_len=len(name)))
+
+    def ListExtensions(self):
+        s = self.server
+        return _Cookie(s, s.request('ListExtensions'), pack(names=[], names_len=0))
+
+    def QueryExtension(self, name_len, name):
+        s = self.server
+        return _Cookie(s, s.request('QueryExtension'),
+                       pack(present=False, major_opcode=0, first_event=0, first_error=0))
+
+    def GetInputFocus(self):
+        s = self.server
+        return _Cookie(s, s.request('GetInputFocus'), pack(focus=s.focus, revert_to=0))
+
+    def SetInputFocus(self, revert_to, focus, time):
+        s = self.server
+        s.focus = focus
+        return _Cookie(s, s.request('SetInputFocus'))
+
+    def GetKeyboardMapping(self, first, count):
+        s = self.server
+        per = s.keysyms_per_keycode
+        return _Cookie(s, s.request('GetKeyboardMapping'), pack(
+            keysyms_per_keycode = per,
+            keysyms = s.keymap[first*per:(first+count)*per],
+        ))
+
+    def GetModifierMapping(self):
+        s = self.server
+        keycodes = []
+        for names in MODIFIERS:
+            codes = [s.keycodes[n] for n in names]
+            keycodes += codes + [0] * (2 - len(codes))
+        return _Cookie(s, s.request('GetModifierMapping'),
+                       pack(keycodes_per_modifier=2, keycodes=keycodes))
+
+    def GrabKey(self, owner_events, wid, modifiers, key, pointer_mode, keyboard_mode):
+        s = self.server
+        s.grabs.add(('key', wid, key, modifiers))
+        return _Cookie(s, s.request('GrabKey'))
+
+    def UngrabKey(self, key, wid, modifiers):
+        s = self.server
+        s.grabs = set(g for g in s.grabs
+                      if not (g[0] == 'key' and g[1] == wid and
+                              key in (xcb.xproto.Grab.Any, g[2]) and
+                              modifiers in (xcb.xproto.ModMask.Any, g[3])))
+        return _Cookie(s, s.request('UngrabKey'))
+
+    def LookupColor(self, cmap, name_len, name):
+        s = self.server
+        # no color database here, derive a stable color from the name
+        h = hash(name) & 0xffffff
+        r, g, b = (h >> 16) * 0x101, ((h >> 8) & 0xff) * 0x101, (h & 0xff) * 0x101
+        return _Cookie(s, s.request('LookupColor'), pack(
+            exact_red=r, exact_green=g, exact_blue=b,
+            visual_red=r, visual_green=g, visual_blue=b,
+        ))
+
+    def CreateWindow(self, depth, wid, parent, x, y, width, height, border_width,
+                     _class, visual, value_mask, value_list):
+        s = self.server
+        w = HeadlessWindow(wid, parent, x, y, width, height, border_width)
+        values = _unmask(value_mask, CW_ORDER, value_list)
+        w.event_mask = values.get(CW.EventMask, 0)
+        w.override_redirect = bool(values.get(CW.OverrideRedirect, False))
+        s.windows[wid] = w
+        if parent in s.windows:
+            s.windows[parent].children.append(wid)
+        return _Cookie(s, s.request('CreateWindow'))
+
+    def GetGeometry(self, wid):
+        seq, w, error = self._window('GetGeometry', wid)
+        if error:
+            return error
+        return _Cookie(self.server, seq, pack(
+            root = ROOT, depth = 24,
+            x = w.x, y = w.y, width = w.width, height = w.height,
+            border_width = w.border_width,
+        ))
+
+    def GetWindowAttributes(self, wid):
+        seq, w, error = self._window('GetWindowAttributes', wid)
+        if error:
+            return error
+        return _Cookie(self.server, seq, pack(
+            backing_store = 0,
+            visual = 0x21,
+            _class = xcb.xproto.WindowClass.InputOutput,
+            bit_gravity = 0,
+            win_gravity = 1,
+            backing_planes = 0,
+            backing_pixel = 0,
+            save_under = False,
+            map_is_installed = True,
+            map_state = MapState.Viewable if w.mapped else MapState.Unmapped,
+            override_redirect = w.override_redirect,
+            colormap = 0x20,
+            all_event_masks = w.event_mask,
+            your_event_mask = w.event_mask,
+            do_not_propagate_mask = 0,
+        ))
+
+    def ChangeWindowAttributes(self, wid, value_mask, value_list):
+        seq, w, error = self._window('ChangeWindowAttributes', wid, void=True)
+        if error:
+            return error
+        values = _unmask(value_mask, CW_ORDER, value_list)
+        if CW.EventMask in values:
+            w.event_mask = values[CW.EventMask]
+        if CW.BorderPixel in values:
+            w.border_pixel = values[CW.BorderPixel]
+        if CW.OverrideRedirect in values:
+            w.override_redirect = bool(values[CW.OverrideRedirect])
+        return _Cookie(self.server, seq)
+
+    def ConfigureWindow(self, wid, value_mask, value_list):
+        seq, w, error = self._window('ConfigureWindow', wid, void=True)
+        if error:
+            return error
+        values = _unmask(value_mask, CONFIG_ORDER, value_list)
+        w.x = values.get(ConfigWindow.X, w.x)
+        w.y = values.get(ConfigWindow.Y, w.y)
+        w.width = values.get(ConfigWindow.Width, w.width)
+        w.height = values.get(ConfigWindow.Height, w.height)
+        w.border_width = values.get(ConfigWindow.BorderWidth, w.border_width)
+        self.server.configure_notify(w)
+        return _Cookie(self.server, seq)
+
+    def MapWindow(self, wid):
+        seq, w, error = self._window('MapWindow', wid, void=True)
+        if error:
+            return error
+        self.server.map(w)
+        return _Cookie(self.server, seq)
+
+    def UnmapWindow(self, wid):
+        seq, w, error = self._window('UnmapWindow', wid, void=True)
+        if error:
+            return error
+        self.server.unmap(w)
+        return _Cookie(self.server, seq)
+
+    def QueryTree(self, wid):
+        seq, w, error = self._window('QueryTree', wid)
+        if error:
+            return error
+        return _Cookie(self.server, seq, pack(
+            root = ROOT,
+            parent = w.parent or 0,
+            children = list(w.children),
+            children_len = len(w.children),
+        ))
+
+    def GetProperty(self, delete, wid, prop, type, long_offset, long_length):
+        seq, w, error = self._window('GetProperty', wid)
+        if error:
+            return error
+        p = w.properties.get(prop)
+        if p is None or (type and type != p[0]):
+            return _Cookie(self.server, seq, pack(
+                format=0, type=0, bytes_after=0, value_len=0,
+                value=PropertyValue(''),
+            ))
+        ptype, format, data = p
+        if delete:
+            del w.properties[prop]
+            self.server.property_notify(w, prop, deleted=True)
+        return _Cookie(self.server, seq, pack(
+            format = format,
+            type = ptype,
+            bytes_after = 0,
+            value_len = len(data) / (format / 8),
+            value = PropertyValue(data),
+        ))
+
+    def ChangeProperty(self, mode, wid, prop, type, format, data_len, data):
+        seq, w, error = self._window('ChangeProperty', wid, void=True)
+        if error:
+            return error
+        if mode == xcb.xproto.PropMode.Append and prop in w.properties:
+            data = w.properties[prop][2] + data
+        elif mode == xcb.xproto.PropMode.Prepend and prop in w.properties:
+            data = data + w.properties[prop][2]
+        w.properties[prop] = (type, format, data)
+        self.server.property_notify(w, prop)
+        return _Cookie(self.server, seq)
+
+    def DeleteProperty(self, wid, prop):
+        seq, w, error = self._window('DeleteProperty', wid, void=True)
+        if error:
+            return error
+        if w.properties.pop(prop, None) is not None:
+            self.server.property_notify(w, prop, deleted=True)
+        return _Cookie(self.server, seq)
+
+    def ListProperties(self, wid):
+        seq, w, error = self._window('ListProperties', wid)
+        if error:
+            return error
+        return _Cookie(self.server, seq, pack(atoms=w.properties.keys()))
+
+    def KillClient(self, wid):
+        s = self.server
+        seq = s.request('KillClient')
+        if wid in s.windows:
+            s.client_destroy(wid)
+        return _Cookie(s, seq)
+
+
+class HeadlessConnection(object):
+    """
+        Stands in for an xcb connection to the modelled server.
+    """
+    pref_screen = 0
+
+    def __init__(self, server):
+        self.server = server
+        self.core = HeadlessCore(server)
+        visual = pack(
+            visual_id = 0x21,
+            _class = xcb.xproto.VisualClass.TrueColor,
+            bits_per_rgb_value = 8,
+            colormap_entries = 256,
+            red_mask = 0xff0000,
+            green_mask = 0x00ff00,
+            blue_mask = 0x0000ff,
+        )
+        self.setup = pack(
+            min_keycode = server.min_keycode,
+            max_keycode = server.max_keycode,
+            roots = [pack(
+                root = ROOT,
+                default_colormap = 0x20,
+                white_pixel = 0xffffff,
+                black_pixel = 0,
+                width_in_pixels = server.width,
+                height_in_pixels = server.height,
+                root_visual = visual.visual_id,
+                root_depth = 24,
+                allowed_depths = [pack(depth=24, visuals=[visual])],
+            )],
+        )
+
+    def __call__(self, key):
+        raise xcb.ExtensionException('no extensions on a headless display')
+
+    def get_setup(self):
+        return self.setup
+
+    def generate_id(self):
+        return self.server.generate_id()
+
+    def poll_for_event(self):
+        if self.server.events:
+            e = self.server.events.popleft()
+            if isinstance(e, xcb.ProtocolException):
+                raise e
+            return e
+        return None
+
+    def flush(self):
+        self.server.flushes += 1
+
+    def get_file_descriptor(self):
+        return -1
+
+    def disconnect(self):
+        pass
@@ -1,31 +1,87 @@
 from orion.wm.window import proto
 import xcb
+import time
+
+import logging
+logger = logging.getLogger(__name__)
 
 class AtomCache:
     def __init__(self, conn):
         self.conn = conn
         self.atoms = {}
         self.reverse = {}
-
-        # We can change the pre-loads not to wait for a return
-        for name in proto.WindowTypes.keys():
-            self.insert(name=name)
+        # number of times we had to wait for the server
+        self.round_trips = 0
 
         for i in dir(xcb.xproto.Atom):
             if not i.startswith("_"):
                 self.insert(name=i, atom=getattr(xcb.xproto.Atom, i))
 
+        start = time.time()
+        self.intern_many(self.preload_names())
+        self.preload_time = time.time() - start
+        logger.debug('preloaded %s atoms in %s round trip(s), %.2f ms'%(
+            len(self.atoms), self.round_trips, self.preload_time*1000))
+
+    @staticmethod
+    def preload_names():
+        """
+            Names of all atoms we know we are going to need.
+        """
+        names = set(proto.WindowTypes.keys())
+        names.update(i for i in proto.WindowStates.keys() if i)
+        names.update(proto.EWMHAtoms)
+        for name, (type, _) in proto.PropertyMap.items():
+            names.add(name)
+            names.add(type)
+        return sorted(names)
+
     def insert(self, name = None, atom = None):
         assert name or atom
         if atom is None:
             c = self.conn.conn.core.InternAtom(False, len(name), name)
             atom = c.reply().atom
+            self.round_trips += 1
         if name is None:
             c = self.conn.conn.core.GetAtomName(atom)
             name = str(c.reply().name.buf())
+            self.round_trips += 1
         self.atoms[name] = atom
         self.reverse[atom] = name
 
+    def intern_many(self, names):
+        """
+            Intern all names which are not cached yet. All InternAtom
+            requests are sent before the first reply is read, so this costs a
+            single round trip.
+        """
+        core = self.conn.conn.core
+        cookies = [(name, core.InternAtom(False, len(name), name))
+                   for name in names if name not in self.atoms]
+        if not cookies:
+            return
+        self.round_trips += 1
+        for name, c in cookies:
+            atom = c.reply().atom
+            self.atoms[name] = atom
+            self.reverse[atom] = name
+
+    def get_names(self, atoms):
+        """
+            Return the names of atoms, fetching all the unknown ones in a
+            single round trip.
+        """
+        core = self.conn.conn.core
+        cookies = [(atom, core.GetAtomName(atom))
+                   for atom in set(atoms) if atom not in self.reverse]
+        if cookies:
+            self.round_trips += 1
+            for atom, c in cookies:
+                name = str(c.reply().name.buf())
+                self.atoms[name] = atom
+                self.reverse[atom] = name
+        return [self.reverse[atom] for atom in atoms]
+
     def get_name(self, atom):
         if atom not in self.reverse:
             self.insert(atom=atom)
@@ -34,4 +90,4 @@ class AtomCache:
     def __getitem__(self, key):
         if key not in self.atoms:
             self.insert(name=key)
-        return self.atoms[key]
\ No newline at end of file
+        return self.atoms[key]
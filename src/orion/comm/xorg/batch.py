@@ -0,0 +1,113 @@
+import xcb
+
+
+class Future(object):
+    """
+        The result of a request queued in a RequestBatch. The reply is read
+        lazily, either when the batch is resolved or on the first call to
+        result(), whichever comes first.
+    """
+    __slots__ = ('cookie', 'convert', 'done', '_value', '_error')
+
+    def __init__(self, cookie, convert=None):
+        self.cookie = cookie
+        self.convert = convert
+        self.done = False
+        self._value = None
+        self._error = None
+
+    def _resolve(self):
+        try:
+            r = self.cookie.reply()
+            self._value = self.convert(r) if self.convert else r
+        except xcb.ProtocolException, e:
+            self._error = e
+        self.cookie = None
+        self.done = True
+
+    def result(self):
+        """
+            Return the reply (converted if a converter was given) or raise
+            the X error the request failed with.
+        """
+        if not self.done:
+            self._resolve()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def error(self):
+        """
+            Return the X error of the request, or None if it succeeded.
+        """
+        if not self.done:
+            self._resolve()
+        return self._error
+
+
+class RequestBatch(object):
+    """
+        Queues requests and resolves them in a single pipelined exchange:
+        all requests are written first and the replies are collected
+        afterwards, so N requests cost one round trip instead of N.
+
+        X errors do not propagate out of resolve(); each one is stored in the
+        future of the request that caused it.
+
+            with orion.conn.batch() as b:
+                geoms = [b.get_geometry(w) for w in windows]
+            for g in geoms:
+                g.result()
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.resolve()
+
+    def __len__(self):
+        return len(self.futures)
+
+    def add(self, cookie, convert=None):
+        """
+            Queue an already issued request cookie. convert is applied to the
+            reply when it arrives.
+        """
+        f = Future(cookie, convert)
+        self.futures.append(f)
+        return f
+
+    def get_geometry(self, win):
+        return self.add(self.conn.conn.core.GetGeometry(win.wid))
+
+    def get_attributes(self, win):
+        return self.add(self.conn.conn.core.GetWindowAttributes(win.wid))
+
+    def get_property(self, win, prop, type=None, unpack=None):
+        """
+            Queue a GetProperty, see Window.get_property for the arguments.
+        """
+        return self.add(
+            win._property_cookie(prop, type),
+            lambda r: win._property_value(r, unpack)
+        )
+
+    def query_tree(self, win):
+        return self.add(self.conn.conn.core.QueryTree(win.wid))
+
+    def resolve(self):
+        """
+            Flush the queued requests and collect all the replies.
+        """
+        futures, self.futures = self.futures, []
+        if futures:
+            self.conn.flush()
+        for f in futures:
+            if not f.done:
+                f._resolve()
+        return futures
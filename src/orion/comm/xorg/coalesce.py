@@ -0,0 +1,67 @@
+from dispatch import ConfigureNotify, MotionNotify, PropertyNotify, \
+                     CreateNotify, DestroyNotify, UnmapNotify, MapNotify, \
+                     MapRequest, ReparentNotify, SEND_EVENT
+
+# events which change the life cycle of a window; coalesced events are never
+# moved across them
+BARRIERS = frozenset([
+    CreateNotify,
+    DestroyNotify,
+    UnmapNotify,
+    MapNotify,
+    MapRequest,
+    ReparentNotify,
+])
+
+
+class EventCoalescer(object):
+    """
+        Merges redundant events drained in one xpoll iteration.
+
+        Only the latest ConfigureNotify and MotionNotify per window and the
+        latest PropertyNotify per (window, atom) survive. The surviving event
+        takes the position of the last one it replaces, so it never precedes
+        any event it was received after. A map, unmap, destroy (or other
+        life cycle) event of a window starts a new generation for it, and
+        events are never merged across generations.
+    """
+    def __init__(self):
+        self.coalesced = 0
+
+    def coalesce(self, events):
+        if len(events) < 2:
+            return events
+        out = []
+        merged = 0
+        pending = {}
+        generation = {}
+        for e in events:
+            rtype = e.response_type
+            if rtype >= SEND_EVENT:
+                out.append(e)
+                continue
+            if rtype == PropertyNotify:
+                wid = e.window
+                key = (rtype, wid, e.atom, generation.get(wid, 0))
+            elif rtype == ConfigureNotify:
+                wid = e.window
+                key = (rtype, e.event, wid, generation.get(wid, 0))
+            elif rtype == MotionNotify:
+                wid = e.event
+                key = (rtype, wid, generation.get(wid, 0))
+            else:
+                if rtype in BARRIERS:
+                    wid = e.window
+                    generation[wid] = generation.get(wid, 0) + 1
+                out.append(e)
+                continue
+            idx = pending.get(key)
+            if idx is not None:
+                out[idx] = None
+                merged += 1
+            pending[key] = len(out)
+            out.append(e)
+        if not merged:
+            return out
+        self.coalesced += merged
+        return [e for e in out if e is not None]
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import xcb.xproto
+
+
+class ColorCache(object):
+    """
+        A bounded color name -> (r, g, b) cache, shared by all colormaps.
+        Channels are 16 bit, as used by the core protocol. The least
+        recently inserted entry is dropped when the cache is full.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.colors = OrderedDict()
+
+    def get(self, name):
+        return self.colors.get(name)
+
+    def put(self, name, rgb):
+        if name not in self.colors and len(self.colors) >= self.size:
+            self.colors.popitem(last=False)
+        self.colors[name] = rgb
+
+    def __contains__(self, name):
+        return name in self.colors
+
+parsed = ColorCache()
+
+
+def parse_hex(color):
+    """
+        Parse a "#rrggbb" color to 16 bit channels, or return None for
+        anything else (e.g. color names, which only the server knows).
+    """
+    if not color.startswith("#"):
+        return None
+    if len(color) != 7:
+        raise ValueError("Invalid color: %s"%color)
+    def x8to16(i):
+        return 0xffff * (i&0xff)/0xff
+    return (
+        x8to16(int(color[1] + color[2], 16)),
+        x8to16(int(color[3] + color[4], 16)),
+        x8to16(int(color[5] + color[6], 16)),
+    )
+
+
+class _Channel(object):
+    """
+        Position of one color channel in a pixel value of a decomposed
+        visual.
+    """
+    def __init__(self, mask):
+        self.shift = 0
+        while mask and not mask & 1:
+            mask >>= 1
+            self.shift += 1
+        self.bits = 0
+        while mask & 1:
+            mask >>= 1
+            self.bits += 1
+
+    def __call__(self, value):
+        return (value >> (16 - self.bits)) << self.shift
+
+
+class AllocatedColor(object):
+    """
+        Mimics the AllocColor reply for locally computed pixels.
+    """
+    def __init__(self, pixel, red, green, blue):
+        self.pixel = pixel
+        self.red, self.green, self.blue = red, green, blue
+
+
+class Colormap:
+    """
+        Color allocation for a colormap.
+
+        On TrueColor and DirectColor visuals pixel values are computed
+        locally from the visual's channel masks, so no request is needed once
+        a color is parsed. Color names are resolved with LookupColor and kept
+        in the shared parsed cache. Other visuals fall back to AllocColor,
+        pipelined when several colors are allocated at once.
+    """
+    decomposed = (xcb.xproto.VisualClass.TrueColor,
+                  xcb.xproto.VisualClass.DirectColor)
+
+    def __init__(self, conn, cid, visual=None):
+        self.conn, self.cid = conn, cid
+        self.local = visual is not None and visual._class in self.decomposed
+        if self.local:
+            self.red = _Channel(visual.red_mask)
+            self.green = _Channel(visual.green_mask)
+            self.blue = _Channel(visual.blue_mask)
+        # color -> AllocatedColor or AllocColor reply
+        self.allocated = {}
+
+    def preload(self, colors):
+        """
+            Resolve colors with pipelined requests, so later alloc_color
+            calls for them never block.
+        """
+        colors = [c for c in set(colors) if c not in self.allocated]
+        core = self.conn.conn.core
+        lookups = []
+        for c in colors:
+            if parse_hex(c) is None and c not in parsed:
+                lookups.append((c, core.LookupColor(self.cid, len(c), c)))
+        for c, cookie in lookups:
+            r = cookie.reply()
+            parsed.put(c, (r.exact_red, r.exact_green, r.exact_blue))
+        if self.local:
+            for c in colors:
+                self.alloc_color(c)
+        else:
+            cookies = [(c, core.AllocColor(self.cid, *self._rgb(c)))
+                       for c in colors]
+            for c, cookie in cookies:
+                self.allocated[c] = cookie.reply()
+
+    def _rgb(self, color):
+        rgb = parsed.get(color)
+        if rgb is None:
+            rgb = parse_hex(color)
+            if rgb is None:
+                r = self.conn.conn.core.LookupColor(self.cid, len(color), color).reply()
+                rgb = (r.exact_red, r.exact_green, r.exact_blue)
+            parsed.put(color, rgb)
+        return rgb
+
+    def alloc_color(self, color):
+        """
+            Flexible color allocation.
+        """
+        c = self.allocated.get(color)
+        if c is not None:
+            return c
+        r, g, b = self._rgb(color)
+        if self.local:
+            c = AllocatedColor(self.red(r) | self.green(g) | self.blue(b), r, g, b)
+        else:
+            c = self.conn.conn.core.AllocColor(self.cid, r, g, b).reply()
+        if self.local and len(self.allocated) >= parsed.size:
+            self.allocated.clear()
+        self.allocated[color] = c
+        return c
+
+    def pixel(self, color):
+        return self.alloc_color(color).pixel
@@ -0,0 +1,91 @@
+import xcb.xproto
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Core event codes (see xproto.xml). xpyb does not expose them as numbers.
+KeyPress         = 2
+KeyRelease       = 3
+ButtonPress      = 4
+ButtonRelease    = 5
+MotionNotify     = 6
+EnterNotify      = 7
+LeaveNotify      = 8
+FocusIn          = 9
+FocusOut         = 10
+KeymapNotify     = 11
+Expose           = 12
+GraphicsExposure = 13
+NoExposure       = 14
+VisibilityNotify = 15
+CreateNotify     = 16
+DestroyNotify    = 17
+UnmapNotify      = 18
+MapNotify        = 19
+MapRequest       = 20
+ReparentNotify   = 21
+ConfigureNotify  = 22
+ConfigureRequest = 23
+GravityNotify    = 24
+ResizeRequest    = 25
+CirculateNotify  = 26
+CirculateRequest = 27
+PropertyNotify   = 28
+SelectionClear   = 29
+SelectionRequest = 30
+SelectionNotify  = 31
+ColormapNotify   = 32
+ClientMessage    = 33
+MappingNotify    = 34
+
+# events with response_type >= SEND_EVENT are delivered through SendEvent
+SEND_EVENT = 128
+
+
+class EventDispatcher(object):
+    """
+        Maps the response_type of an X event to a prebuilt handler. Dispatch
+        is a single list lookup, so its cost does not depend on the number of
+        event types we know about.
+
+        Handlers are plain callables taking the event. Events sent with
+        SendEvent (response_type >= 128) go to the client_message handler,
+        everything without a registered handler goes to unknown.
+    """
+    def __init__(self):
+        self.handlers = [None] * SEND_EVENT
+        self.client_message = None
+        self.unknown = self._unknown
+        self.unknown_count = 0
+
+    def register(self, code, handler):
+        """
+            Register handler for the core event code. Registering
+            ClientMessage also handles events sent with SendEvent.
+        """
+        self.handlers[code] = handler
+        if code == ClientMessage:
+            self.client_message = handler
+
+    def unregister(self, code):
+        self.handlers[code] = None
+        if code == ClientMessage:
+            self.client_message = None
+
+    def dispatch(self, e):
+        rtype = e.response_type
+        if rtype >= SEND_EVENT:
+            # This should be done in xpyb
+            # client mesages start at 128
+            e = xcb.xproto.ClientMessageEvent(e)
+            handler = self.client_message
+        else:
+            handler = self.handlers[rtype]
+        if handler is None:
+            self.unknown(e)
+        else:
+            handler(e)
+
+    def _unknown(self, e):
+        self.unknown_count += 1
+        logger.debug('unknown event: %s (%s)'%(e.__class__.__name__, e.response_type))
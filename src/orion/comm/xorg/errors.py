@@ -0,0 +1,116 @@
+from collections import deque
+from suppress import sequence
+
+import logging
+logger = logging.getLogger(__name__)
+
+# core request opcodes, used when an error can not be matched to a tracked
+# request (see xproto.xml)
+OPCODES = {
+    1: 'CreateWindow',
+    2: 'ChangeWindowAttributes',
+    3: 'GetWindowAttributes',
+    4: 'DestroyWindow',
+    6: 'ChangeSaveSet',
+    8: 'MapWindow',
+    10: 'UnmapWindow',
+    12: 'ConfigureWindow',
+    14: 'GetGeometry',
+    15: 'QueryTree',
+    18: 'ChangeProperty',
+    19: 'DeleteProperty',
+    20: 'GetProperty',
+    25: 'SendEvent',
+    28: 'GrabButton',
+    29: 'UngrabButton',
+    33: 'GrabKey',
+    34: 'UngrabKey',
+    41: 'WarpPointer',
+    42: 'SetInputFocus',
+    113: 'KillClient',
+}
+
+# errors whose bad_value is the resource the request was about
+RESOURCE_ERRORS = frozenset([
+    'BadWindow',
+    'BadPixmap',
+    'BadCursor',
+    'BadFont',
+    'BadDrawable',
+    'BadColormap',
+    'BadGContext',
+])
+
+
+class ErrorRouter(object):
+    """
+        Matches the X errors of requests sent without waiting for their
+        outcome with the window and operation they were sent for.
+
+        Unchecked requests report their errors through the event stream.
+        track() remembers the sequence number of such a request (xpyb
+        cookies do not tell it, the CountingConnection wrapping them does),
+        route() looks the error's sequence number up. Only the last size
+        tracked requests are kept. When the request was not tracked, the
+        window is taken from the error's bad value and the operation from
+        its major opcode.
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        # 16 bit sequence number -> (wid, operation)
+        self.requests = {}
+        self.order = deque()
+        # error name -> count
+        self.counts = {}
+        # (error name, operation) -> count
+        self.per_request = {}
+        self.untracked = 0
+
+    def track(self, cookie, wid, op):
+        seq = getattr(cookie, 'sequence', None)
+        if seq is None:
+            return
+        seq &= 0xffff
+        entry = (wid, op)
+        if len(self.order) >= self.size:
+            old, old_entry = self.order.popleft()
+            if self.requests.get(old) is old_entry:
+                del self.requests[old]
+        self.requests[seq] = entry
+        self.order.append((seq, entry))
+
+    def route(self, error):
+        """
+            Count error (an xcb.ProtocolException) and return the window and
+            the operation of the request which caused it. Either can be None
+            if it is unknown.
+        """
+        name = type(error).__name__
+        e = error.args[0] if error.args else None
+        entry = None
+        if e is not None:
+            entry = self.requests.pop(sequence(e), None)
+            if entry is not None and name in RESOURCE_ERRORS and \
+                    entry[0] is not None and \
+                    entry[0] != getattr(e, 'bad_value', entry[0]):
+                # numbered wrong: xcb sent a request of its own meanwhile
+                entry = None
+        if entry is not None:
+            wid, op = entry
+        else:
+            self.untracked += 1
+            wid = getattr(e, 'bad_value', None) if name in RESOURCE_ERRORS else None
+            op = OPCODES.get(getattr(e, 'major_opcode', None))
+        self.counts[name] = self.counts.get(name, 0) + 1
+        key = (name, op)
+        self.per_request[key] = self.per_request.get(key, 0) + 1
+        logger.debug('%s in %s of window %s'%(name, op, wid))
+        return wid, op
+
+    def stats(self):
+        return dict(
+            errors = dict(self.counts),
+            per_request = dict(('%s %s'%k, v) for k, v in self.per_request.iteritems()),
+            untracked = self.untracked,
+            tracked = len(self.requests),
+        )
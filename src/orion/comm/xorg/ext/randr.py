@@ -1,25 +1,107 @@
-import xcb
-from orion.wm.screen.screen import Screen
+import xcb, xcb.randr
+from orion.wm.screen.pseudoscreen import PseudoScreen
+from orion import utils
 from pyutilib.component.core import implements, SingletonPlugin
 from api import IXorgExtension
 
+import logging
+logger = logging.getLogger(__name__)
+
 class RandR(SingletonPlugin):
     implements (IXorgExtension)
-    
+
     def __init__(self):
         self.name = 'randr'
-        
+        # monitor changes are emitted as outputs_change
+        self.notifies = True
+        # crtc -> PseudoScreen of the last query
+        self.crtcs = {}
+        self.__dirty = False
+
     def init(self, conn):
         self.ext = conn.conn(xcb.randr.key)
         self.__conn = conn
+        self.root = conn.screens[0].root.wid
+
+        # get notified about monitor hotplug and mode changes
+        self.ext.SelectInput(self.root,
+            xcb.randr.NotifyMask.ScreenChange |
+            xcb.randr.NotifyMask.CrtcChange |
+            xcb.randr.NotifyMask.OutputChange
+        )
+        first_event = conn.conn.core.QueryExtension(5, 'RANDR').reply().first_event
+        # RRScreenChangeNotify and RRNotify (crtc/output/property changes)
+        conn.dispatcher.register(first_event, self.handle_notify)
+        conn.dispatcher.register(first_event + 1, self.handle_notify)
 
     def query_screens(self):
-        screens = self.query_crtcs(self.__conn.screens[0].root.wid)
+        screens = self.query_crtcs(self.root)
+        self.crtcs = dict((s.id, s) for s in screens)
         return screens
-    
+
     def query_crtcs(self, root):
+        """
+            Return a PseudoScreen for every enabled CRTC. CRTC and output
+            information is requested in two pipelined batches, regardless of
+            the number of CRTCs.
+        """
+        res = self.ext.GetScreenResources(root).reply()
+        ts = res.config_timestamp
+        cookies = [(i, self.ext.GetCrtcInfo(i, ts)) for i in res.crtcs]
+        infos = []
+        for i, c in cookies:
+            info = c.reply()
+            # disabled CRTCs have no mode and no outputs
+            if not info.mode or not info.num_outputs:
+                continue
+            infos.append((i, info))
+
+        outputs = {}
+        cookies = [(o, self.ext.GetOutputInfo(o, ts))
+                   for _, info in infos for o in info.outputs]
+        for o, c in cookies:
+            outputs[o] = utils.chrArr(c.reply().name)
+
         l = []
-        for i in self.ext.GetScreenResources(root).reply().crtcs:
-            info = self.ext.GetCrtcInfo(i, xcb.xcb.CurrentTime).reply()
-            l.append(Screen(info.x_org, info.y_org, info.width, info.height))
-        return l
\ No newline at end of file
+        seen = set()
+        for i, info in infos:
+            geometry = (info.x, info.y, info.width, info.height)
+            # CRTCs cloning the same area are a single screen for us
+            if geometry in seen:
+                continue
+            seen.add(geometry)
+            l.append(PseudoScreen(info.x, info.y, info.width, info.height,
+                id = i,
+                outputs = [outputs[o] for o in info.outputs],
+            ))
+        return l
+
+    def handle_notify(self, e):
+        # A single hotplug produces a burst of notifies; query once per drain.
+        if not self.__dirty:
+            self.__dirty = True
+            self.__conn.call_after_drain(self.update)
+
+    def update(self):
+        """
+            Re-query the CRTCs and emit outputs_change with the difference to
+            the previous state.
+        """
+        self.__dirty = False
+        old = self.crtcs
+        screens = self.query_crtcs(self.root)
+        new = dict((s.id, s) for s in screens)
+        added = [s for i, s in new.items() if i not in old]
+        removed = [s for i, s in old.items() if i not in new]
+        changed = [s for i, s in new.items()
+                   if i in old and s.geometry() != old[i].geometry()]
+        self.crtcs = new
+        self.__conn.pseudoscreens = screens
+        if added or removed or changed:
+            logger.debug('outputs changed: added %s, removed %s, changed %s'%(
+                added, removed, changed))
+            self.__conn.events.outputs_change(self.__conn,
+                added = added,
+                removed = removed,
+                changed = changed,
+            )
@@ -1,5 +1,5 @@
 import xcb.xinerama
-from orion.wm.screen.screen import Screen
+from orion.wm.screen.pseudoscreen import PseudoScreen
 from pyutilib.component.core import implements, SingletonPlugin
 from api import IXorgExtension
 
@@ -8,10 +8,13 @@ class Xinerama(SingletonPlugin):
     
     def __init__(self):
         self.name = 'xinerama'
+        # no notification of monitor changes
+        self.notifies = False
         
     def init(self, conn):
         self.ext = conn.conn(xcb.xinerama.key)
 
     def query_screens(self):
         info = self.ext.QueryScreens().reply().screen_info
-        return [Screen(s.x_org, s.y_org, s.width, s.height) for s in info]
\ No newline at end of file
+        return [PseudoScreen(s.x_org, s.y_org, s.width, s.height, id=i)
+                for i, s in enumerate(info)]
\ No newline at end of file
@@ -0,0 +1,138 @@
+import xcb.xproto
+from xcb.xproto import GrabMode
+from orion.comm.xorg import keyboard
+
+import logging
+logger = logging.getLogger(__name__)
+
+class GrabManager(object):
+    """
+        Passive key and button grabs, kept in sync with a set of bindings.
+
+        Bindings are stated in terms of keysyms and the modifiers the user
+        means. Every binding is grabbed once per lock variant (plain,
+        numlock, numlock + capslock), so the binding works whatever the
+        state of the lock keys is. sync computes the grabs the bindings need
+        with the current keymap and modifier map and sends only the
+        differences to what is currently grabbed, all without waiting for
+        a reply; adding or removing bindings and keymap changes just mark
+        the manager dirty, the connection syncs it at the end of the cycle.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        # (wid, keysym, modmask)
+        self.keys = set()
+        # (wid, button, modmask) -> event mask
+        self.buttons = {}
+        # what the server currently has, (wid, keycode, modmask) and
+        # (wid, button, modmask) -> event mask
+        self.grabbed_keys = set()
+        self.grabbed_buttons = {}
+        self.dirty = False
+        self.requests = 0
+
+    def reset(self, wid):
+        """
+            Release every key and button grab on wid, including those left
+            by a previous window manager or run, which sync knows nothing
+            about.
+        """
+        core = self.conn.conn.core
+        track = self.conn.errors.track
+        track(core.UngrabKey(xcb.xproto.Grab.Any, wid, xcb.xproto.ModMask.Any),
+              wid, 'UngrabKey')
+        track(core.UngrabButton(xcb.xproto.ButtonIndex.Any, wid,
+                                xcb.xproto.ModMask.Any),
+              wid, 'UngrabButton')
+        self.grabbed_keys = set(g for g in self.grabbed_keys if g[0] != wid)
+        self.grabbed_buttons = dict((g, m) for g, m in self.grabbed_buttons.items()
+                                    if g[0] != wid)
+        self.requests += 2
+        self.dirty = True
+
+    def add_key(self, wid, keysym, modmask):
+        self.keys.add((wid, keysym, modmask))
+        self.dirty = True
+
+    def remove_key(self, wid, keysym, modmask):
+        self.keys.discard((wid, keysym, modmask))
+        self.dirty = True
+
+    def add_button(self, wid, button, modmask, event_mask):
+        self.buttons[(wid, button, modmask)] = event_mask
+        self.dirty = True
+
+    def remove_button(self, wid, button, modmask):
+        self.buttons.pop((wid, button, modmask), None)
+        self.dirty = True
+
+    def lock_masks(self):
+        """
+            Return the modifier masks a binding is grabbed with.
+        """
+        conn = self.conn
+        numlock = conn.get_modifier_mask(
+            conn.keysym_to_keycode(keyboard.keysyms["Num_Lock"]))
+        if not numlock:
+            return (0,)
+        return (0, numlock, numlock | keyboard.modmasks["lock"])
+
+    def wanted(self):
+        """
+            Return the key and button grabs the bindings need, in the form
+            of grabbed_keys and grabbed_buttons.
+        """
+        locks = self.lock_masks()
+        keys = set()
+        for wid, keysym, modmask in self.keys:
+            keycode = self.conn.keysym_to_keycode(keysym)
+            if not keycode:
+                continue
+            for lock in locks:
+                keys.add((wid, keycode, modmask | lock))
+        buttons = {}
+        for (wid, button, modmask), event_mask in self.buttons.items():
+            for lock in locks:
+                buttons[(wid, button, modmask | lock)] = event_mask
+        return keys, buttons
+
+    def sync(self):
+        """
+            Send the grabs and ungrabs needed to make the server match the
+            bindings. Returns the number of requests sent.
+        """
+        self.dirty = False
+        core = self.conn.conn.core
+        track = self.conn.errors.track
+        keys, buttons = self.wanted()
+        n = 0
+
+        for wid, keycode, modmask in self.grabbed_keys - keys:
+            track(core.UngrabKey(keycode, wid, modmask), wid, 'UngrabKey')
+            n += 1
+        for wid, keycode, modmask in keys - self.grabbed_keys:
+            track(core.GrabKey(True, wid, modmask, keycode,
+                               GrabMode.Async, GrabMode.Async),
+                  wid, 'GrabKey')
+            n += 1
+
+        for (wid, button, modmask) in self.grabbed_buttons:
+            if (wid, button, modmask) not in buttons:
+                track(core.UngrabButton(button, wid, modmask), wid, 'UngrabButton')
+                n += 1
+        for (wid, button, modmask), event_mask in buttons.items():
+            # a grab of the same combination replaces ours
+            if self.grabbed_buttons.get((wid, button, modmask)) != event_mask:
+                track(core.GrabButton(True, wid, event_mask,
+                                      GrabMode.Async, GrabMode.Async,
+                                      xcb.xproto.Atom._None, xcb.xproto.Atom._None,
+                                      button, modmask),
+                      wid, 'GrabButton')
+                n += 1
+
+        self.grabbed_keys = keys
+        self.grabbed_buttons = buttons
+        self.requests += n
+        if n:
+            logger.debug('grabs synced with %s requests'%n)
+        return n
@@ -1,2 +1,2 @@
-from xkeysyms import *
+from keysymdb import keysyms
 from modmasks import *
\ No newline at end of file
@@ -0,0 +1,103 @@
+from array import array
+from itertools import chain
+
+
+class Keymap(object):
+    """
+        The keycode x column keysym table of the server, stored in a flat
+        array, together with a keysym -> keycode index covering every
+        column.
+
+        The table is indexed by keycode * per + column, where per is the
+        number of keysyms per keycode. The index maps each keysym to the
+        position of its preferred occurrence: the lowest column, then the
+        lowest keycode.
+    """
+    def __init__(self, min_keycode, max_keycode):
+        self.min_keycode = min_keycode
+        self.max_keycode = max_keycode
+        self.per = 0
+        self.syms = array('I')
+        self.sym_to_pos = {}
+
+    def update(self, first, per, keysyms):
+        """
+            Replace the keysyms of keycodes first .. first + len(keysyms)/per
+            with keysyms, as returned by GetKeyboardMapping. Only the affected
+            part of the reverse index is rebuilt, unless per changes.
+        """
+        count = len(keysyms) // per
+        if per != self.per:
+            self._restride(per)
+        syms = self.syms
+        start = first * per
+        stop = start + count * per
+
+        # drop the index entries pointing into the replaced range
+        orphans = set()
+        for pos in xrange(start, stop):
+            s = syms[pos]
+            if s and self.sym_to_pos.get(s) == pos:
+                del self.sym_to_pos[s]
+                orphans.add(s)
+
+        syms[start:stop] = array('I', keysyms)
+
+        for pos in xrange(start, stop):
+            s = syms[pos]
+            if s:
+                self._index(s, pos)
+
+        # keysyms whose preferred occurrence was replaced may have a better
+        # one outside of the range
+        if orphans:
+            for pos in chain(xrange(start), xrange(stop, len(syms))):
+                if syms[pos] in orphans:
+                    self._index(syms[pos], pos)
+
+    def _restride(self, per):
+        """
+            Change the number of keysyms per keycode, keeping the keysyms of
+            every keycode (extra columns are dropped, new ones are empty),
+            and rebuild the index.
+        """
+        old, old_per = self.syms, self.per
+        syms = array('I', [0]) * ((self.max_keycode + 1) * per)
+        n = min(per, old_per)
+        if n:
+            for keycode in xrange(len(old) // old_per):
+                syms[keycode * per:keycode * per + n] = \
+                    old[keycode * old_per:keycode * old_per + n]
+        self.per = per
+        self.syms = syms
+        self.sym_to_pos = {}
+        for pos, s in enumerate(syms):
+            if s:
+                self._index(s, pos)
+
+    def _index(self, keysym, pos):
+        cur = self.sym_to_pos.get(keysym)
+        if cur is None or self._order(pos) < self._order(cur):
+            self.sym_to_pos[keysym] = pos
+
+    def _order(self, pos):
+        keycode, col = divmod(pos, self.per)
+        return col, keycode
+
+    def keycode_to_keysym(self, keycode, col=0):
+        if col >= self.per or not self.min_keycode <= keycode <= self.max_keycode:
+            return 0
+        return self.syms[keycode * self.per + col]
+
+    def keysym_to_keycode(self, keysym):
+        pos = self.sym_to_pos.get(keysym)
+        if pos is None:
+            return 0
+        return pos // self.per
+
+    def keysyms(self, keycode):
+        """
+            Return all the keysyms of keycode.
+        """
+        start = keycode * self.per
+        return self.syms[start:start + self.per].tolist()
@@ -0,0 +1,147 @@
+"""
+    The keysym database: keysym <-> name lookups in both directions.
+
+    The table (keysymdef) is only imported and indexed on the first lookup.
+    Keysyms of the Unicode range (0x01000000 + code point) are computed:
+    "U20AC" names the euro sign keysym, and every Unicode keysym without a
+    name of its own is named that way. The braille_dots_* names are computed
+    as well.
+"""
+
+UNICODE = 0x01000000
+UNICODE_MAX = 0x0110ffff
+BRAILLE = UNICODE + 0x2800
+
+
+class KeysymDB(object):
+    """
+        Lazily loaded keysym database. It also works as a read only name ->
+        keysym mapping, so keysyms["Return"] and keysyms.get(name) keep
+        working.
+    """
+    def __init__(self):
+        self._by_name = None
+        self._by_keysym = None
+        self._by_lower = None
+
+    def _load(self):
+        from keysymdef import DATA
+        by_name = {}
+        by_keysym = {}
+        for line in DATA.splitlines():
+            name, value = line.split()
+            value = int(value, 16)
+            by_name[name] = value
+            if value not in by_keysym:
+                by_keysym[value] = name
+        self._by_name = by_name
+        self._by_keysym = by_keysym
+
+    def _computed(self, name):
+        if name[:1] == 'U' and len(name) > 1:
+            try:
+                keysym = UNICODE + int(name[1:], 16)
+            except ValueError:
+                return None
+            if keysym <= UNICODE_MAX:
+                return keysym
+        elif name.startswith('braille_dots_'):
+            dots = name[len('braille_dots_'):]
+            mask = 0
+            for c in dots:
+                if not '1' <= c <= '8' or mask & 1 << int(c) - 1:
+                    return None
+                mask |= 1 << int(c) - 1
+            if mask and ''.join(sorted(dots)) == dots:
+                return BRAILLE + mask
+        return None
+
+    def keysym(self, name):
+        """
+            Return the keysym of name, or None.
+        """
+        if self._by_name is None:
+            self._load()
+        keysym = self._by_name.get(name)
+        if keysym is None:
+            keysym = self._computed(name)
+        return keysym
+
+    def keysym_nocase(self, name):
+        """
+            Like keysym, but ignoring case when there is no exact match.
+            Among names differing only in case the lowest keysym wins.
+        """
+        keysym = self.keysym(name)
+        if keysym is not None:
+            return keysym
+        if self._by_lower is None:
+            self._by_lower = by_lower = {}
+            for n, k in self._by_name.iteritems():
+                l = n.lower()
+                if l not in by_lower or k < by_lower[l]:
+                    by_lower[l] = k
+        keysym = self._by_lower.get(name.lower())
+        if keysym is None and name[:1] in 'uU':
+            keysym = self._computed('U' + name[1:])
+        return keysym
+
+    def name(self, keysym):
+        """
+            Return the canonical name of keysym, or None if it has none.
+        """
+        if self._by_keysym is None:
+            self._load()
+        name = self._by_keysym.get(keysym)
+        if name is None and UNICODE <= keysym <= UNICODE_MAX:
+            if BRAILLE < keysym <= BRAILLE + 0xff:
+                mask = keysym - BRAILLE
+                return 'braille_dots_' + ''.join(
+                    str(i + 1) for i in range(8) if mask & 1 << i)
+            return 'U%04X'%(keysym - UNICODE)
+        return name
+
+    def to_unicode(self, keysym):
+        """
+            Return the character of a Latin-1 or Unicode keysym, or None.
+        """
+        if 0x20 <= keysym <= 0x7e or 0xa0 <= keysym <= 0xff:
+            return unichr(keysym)
+        if UNICODE + 0x100 <= keysym <= UNICODE_MAX:
+            try:
+                return unichr(keysym - UNICODE)
+            except ValueError:
+                # narrow python build
+                return None
+        return None
+
+    def from_unicode(self, char):
+        """
+            Return the keysym of a character.
+        """
+        cp = ord(char)
+        if 0x20 <= cp <= 0x7e or 0xa0 <= cp <= 0xff:
+            return cp
+        return UNICODE + cp
+
+    def __getitem__(self, name):
+        keysym = self.keysym(name)
+        if keysym is None:
+            raise KeyError(name)
+        return keysym
+
+    def get(self, name, default=None):
+        keysym = self.keysym(name)
+        if keysym is None:
+            return default
+        return keysym
+
+    def __contains__(self, name):
+        return self.keysym(name) is not None
+
+    def __len__(self):
+        if self._by_name is None:
+            self._load()
+        return len(self._by_name)
+
+keysyms = KeysymDB()
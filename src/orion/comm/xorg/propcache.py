@@ -0,0 +1,137 @@
+import logging
+logger = logging.getLogger(__name__)
+
+class _Pending(object):
+    """
+        A prefetched property whose reply has not been read yet.
+    """
+    __slots__ = ('cookie',)
+
+    def __init__(self, cookie):
+        self.cookie = cookie
+
+
+class PropertyCache(object):
+    """
+        GetProperty replies of watched windows, per window and atom.
+
+        Only windows which select PropertyChange are watched, since the
+        cache relies on PropertyNotify: a reply stays valid until a
+        PropertyNotify for its atom arrives (invalidate) or the window is
+        destroyed (forget). Requests for other windows go straight to the
+        server.
+
+        Prefetched replies which were not read when their entry is dropped
+        stay queued in xcb until read; their cookies are kept in stale and
+        their replies thrown away after the next drain, or by the next get
+        which waits for a reply anyway.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        # wid -> atom -> type -> reply or _Pending
+        self.windows = {}
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.invalidations = 0
+        # cookies of dropped _Pending entries
+        self.stale = []
+
+    def watch(self, wid):
+        if wid not in self.windows:
+            self.windows[wid] = {}
+
+    def forget(self, wid):
+        props = self.windows.pop(wid, None)
+        if props is not None:
+            for types in props.itervalues():
+                self._drop(types)
+
+    def invalidate(self, wid, atom):
+        props = self.windows.get(wid)
+        if props is None:
+            return
+        types = props.pop(atom, None)
+        if types is not None:
+            self.invalidations += 1
+            self._drop(types)
+
+    def _drop(self, types):
+        self.drop([r.cookie for r in types.itervalues() if isinstance(r, _Pending)])
+
+    def drop(self, cookies):
+        """
+            Throw away the replies of cookies (of any request) which will
+            not be read.
+        """
+        if cookies:
+            if not self.stale:
+                self.conn.call_after_drain(self.discard)
+            self.stale.extend(cookies)
+
+    def discard(self):
+        """
+            Read and throw away the replies of the stale cookies.
+        """
+        stale, self.stale = self.stale, []
+        for cookie in stale:
+            try:
+                cookie.reply()
+            except Exception:
+                # the window may be gone already
+                pass
+
+    def _read(self, request):
+        if self.stale:
+            # the stale replies come before this one
+            self.discard()
+        return request.reply()
+
+    def get(self, win, prop, type=None):
+        """
+            Return the GetProperty reply of prop on win.
+        """
+        atom, type = win._property_atoms(prop, type)
+        props = self.windows.get(win.wid)
+        if props is None:
+            self.uncached += 1
+            return self._read(win._property_request(atom, type))
+        types = props.get(atom)
+        r = types.get(type) if types is not None else None
+        if r is None:
+            self.misses += 1
+            r = self._read(win._property_request(atom, type))
+            props.setdefault(atom, {})[type] = r
+        else:
+            self.hits += 1
+            if isinstance(r, _Pending):
+                try:
+                    r = r.cookie.reply()
+                except:
+                    del types[type]
+                    raise
+                types[type] = r
+        return r
+
+    def prefetch(self, win, props):
+        """
+            Request the (prop, type) pairs of props which are not cached yet
+            without waiting for the replies; later gets read them.
+        """
+        cache = self.windows.get(win.wid)
+        if cache is None:
+            return
+        for prop, type in props:
+            atom, type = win._property_atoms(prop, type)
+            types = cache.setdefault(atom, {})
+            if type not in types:
+                types[type] = _Pending(win._property_request(atom, type))
+
+    def stats(self):
+        return dict(
+            windows = len(self.windows),
+            hits = self.hits,
+            misses = self.misses,
+            uncached = self.uncached,
+            invalidations = self.invalidations,
+        )
@@ -0,0 +1,396 @@
+"""
+    Recording and offline replay of an X session.
+
+    A recording is a binary log of the raw X event stream, the boundaries of
+    event drains and the replies to every request, each with a timestamp.
+    The file is a header followed by self-delimiting records:
+
+        header:  magic "ORIONREC", uint32 version
+        record:  uint8 kind, float64 time, uint32 size, payload (size bytes)
+
+    All numbers are little-endian. EVENT payloads are the raw event bytes,
+    DRAIN records have no payload and REPLY payloads are
+
+        uint16 len(key), uint16 len(class), key, class, raw reply bytes
+
+    where key identifies the request and its arguments and class is the
+    reply type (empty for plain values). ERROR records are laid out like
+    REPLY records: an X error raised by a reply has the key of the request,
+    one raised by the event stream an empty key, which places it among the
+    events of its drain. Their class is that of the exception followed,
+    after a space, by that of the error and the raw bytes are those of the
+    error. Records can be read sequentially from a stream or straight out
+    of a memory map.
+
+    Set ORION_RECORD=path to record a session and ORION_REPLAY=path to run
+    orion against a recording instead of a display.
+"""
+import mmap, struct, time
+from ast import literal_eval
+from collections import deque
+import xcb, xcb.xproto
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = 'ORIONREC'
+VERSION = 1
+HEADER = struct.Struct('<8sI')
+RECORD = struct.Struct('<BdI')
+REPLY = struct.Struct('<HH')
+
+EVENT = 1
+DRAIN = 2
+REPLY_DATA = 3
+ERROR = 4
+
+
+class RecordError(Exception): pass
+
+
+def _raw(obj):
+    return str(buffer(obj))
+
+
+def _class_name(obj):
+    return '%s.%s'%(obj.__class__.__module__, obj.__class__.__name__)
+
+
+def _load(cls):
+    module, name = cls.rsplit('.', 1)
+    return getattr(__import__(module, fromlist=[name]), name)
+
+
+def _extension_name(key):
+    import xcb.randr, xcb.xinerama
+    return {
+        xcb.randr.key: 'randr',
+        xcb.xinerama.key: 'xinerama',
+    }.get(key, 'unknown')
+
+
+def _extension_modules():
+    """
+        (X extension name, xpyb module) of the extensions whose events can
+        be replayed.
+    """
+    import xcb.randr, xcb.xinerama
+    return [('RANDR', xcb.randr), ('XINERAMA', xcb.xinerama)]
+
+
+class Recorder(object):
+    """
+        Writes records to a file.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.count = 0
+
+    def write(self, kind, payload=''):
+        self.file.write(RECORD.pack(kind, time.time(), len(payload)))
+        self.file.write(payload)
+        self.count += 1
+
+    def event(self, e):
+        self.write(EVENT, _raw(e))
+
+    def drain(self):
+        self.write(DRAIN)
+        self.file.flush()
+
+    def reply(self, key, r):
+        if isinstance(r, xcb.Protobj):
+            cls = _class_name(r)
+            raw = _raw(r)
+        else:
+            cls, raw = '', repr(r)
+        self.write(REPLY_DATA, REPLY.pack(len(key), len(cls)) + key + cls + raw)
+
+    def error(self, key, exc):
+        """
+            Record the xcb.ProtocolException exc, raised by the reply of the
+            request key, or by the event stream if key is empty.
+        """
+        e = exc.args[0] if exc.args else None
+        cls = _class_name(exc)
+        raw = ''
+        if isinstance(e, xcb.Protobj):
+            cls += ' ' + _class_name(e)
+            raw = _raw(e)
+        self.write(ERROR, REPLY.pack(len(key), len(cls)) + key + cls + raw)
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(f):
+    """
+        Yield (kind, time, payload) tuples from a file-like object; a memory
+        map works as well as a stream.
+    """
+    magic, version = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise RecordError('not an orion recording (version %s)'%VERSION)
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return
+        kind, t, size = RECORD.unpack(head)
+        yield kind, t, f.read(size)
+
+
+def parse_reply(payload):
+    klen, clen = REPLY.unpack_from(payload)
+    start = REPLY.size
+    key = payload[start:start+klen]
+    cls = payload[start+klen:start+klen+clen]
+    return key, cls, payload[start+klen+clen:]
+
+
+def _key(name, args):
+    return repr((name, args))
+
+
+#### recording
+
+class _RecordingCookie(object):
+    def __init__(self, cookie, recorder, key):
+        self.cookie, self.recorder, self.key = cookie, recorder, key
+
+    def reply(self):
+        try:
+            r = self.cookie.reply()
+        except xcb.ProtocolException, e:
+            self.recorder.error(self.key, e)
+            raise
+        self.recorder.reply(self.key, r)
+        return r
+
+    def check(self):
+        return self.cookie.check()
+
+    def __getattr__(self, name):
+        return getattr(self.cookie, name)
+
+
+class _RecordingExtension(object):
+    def __init__(self, ext, recorder, prefix):
+        self.ext, self.recorder, self.prefix = ext, recorder, prefix
+
+    def __getattr__(self, name):
+        request = getattr(self.ext, name)
+        key = self.prefix + name
+        def f(*args):
+            return _RecordingCookie(request(*args), self.recorder, _key(key, args))
+        return f
+
+
+class RecordingConnection(object):
+    """
+        Wraps an xcb connection and records the events polled from it and
+        the replies of all requests made through it.
+    """
+    def __init__(self, conn, recorder):
+        self.conn = conn
+        self.recorder = recorder
+        self.core = _RecordingExtension(conn.core, recorder, '')
+        self.pref_screen = conn.pref_screen
+        recorder.reply(_key('pref_screen', ()), conn.pref_screen)
+
+    def __call__(self, key):
+        return _RecordingExtension(self.conn(key), self.recorder,
+                                   _extension_name(key) + '.')
+
+    def get_setup(self):
+        r = self.conn.get_setup()
+        self.recorder.reply(_key('get_setup', ()), r)
+        return r
+
+    def generate_id(self):
+        r = self.conn.generate_id()
+        self.recorder.reply(_key('generate_id', ()), r)
+        return r
+
+    def poll_for_event(self):
+        try:
+            e = self.conn.poll_for_event()
+        except xcb.ProtocolException, error:
+            self.recorder.error('', error)
+            raise
+        if e:
+            self.recorder.event(e)
+        else:
+            self.recorder.drain()
+        return e
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+#### replay
+
+class _ReplayCookie(object):
+    def __init__(self, replay, key):
+        self.replay, self.key = replay, key
+
+    def reply(self):
+        return self.replay.reply(self.key)
+
+    def check(self):
+        pass
+
+
+class _ReplayExtension(object):
+    def __init__(self, replay, prefix):
+        self.replay, self.prefix = replay, prefix
+
+    def __getattr__(self, name):
+        key = self.prefix + name
+        def f(*args):
+            self.replay.requests += 1
+            return _ReplayCookie(self.replay, _key(key, args))
+        return f
+
+
+class Replay(object):
+    """
+        A recording loaded for replay. Replies are answered per request key
+        in recorded order; the last reply of a key is repeated once the
+        recorded ones are used up. Recorded X errors are raised again where
+        they happened. A request whose reply was not recorded,
+        e.g. one a newer version makes, is counted in missing and answered
+        with None, so the replay goes on.
+    """
+    def __init__(self, path):
+        f = open(path, 'rb')
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        f.close()
+        # key -> deque of (class, raw bytes, whether it is an error)
+        self.replies = {}
+        # list of drains, each a list of raw events and of (class, raw
+        # bytes) errors
+        self.drains = []
+        self.events = 0
+        self.requests = 0
+        self.missing = 0
+        current = []
+        for kind, t, payload in read_records(self.map):
+            if kind == EVENT:
+                current.append(payload)
+                self.events += 1
+            elif kind == DRAIN:
+                if current:
+                    self.drains.append(current)
+                current = []
+            elif kind == REPLY_DATA:
+                key, cls, raw = parse_reply(payload)
+                self.replies.setdefault(key, deque()).append((cls, raw, False))
+            elif kind == ERROR:
+                key, cls, raw = parse_reply(payload)
+                if key:
+                    self.replies.setdefault(key, deque()).append((cls, raw, True))
+                else:
+                    current.append((cls, raw))
+        if current:
+            self.drains.append(current)
+        # response_type -> event class, as generated by xpyb
+        self.classes = dict(getattr(xcb.xproto, '_events', {}))
+        self._extension_events()
+
+    def _extension_events(self):
+        """
+            Add the event classes of the extensions the recorded session
+            queried; their numbers start at the recorded first_event.
+        """
+        for name, module in _extension_modules():
+            q = self.replies.get(_key('QueryExtension', (len(name), name)))
+            if not q:
+                continue
+            cls, raw, error = q[0]
+            if error:
+                continue
+            first = self._decode(cls, raw).first_event
+            for n, cls in getattr(module, '_events', {}).iteritems():
+                self.classes[first + n] = cls
+
+    def _decode(self, cls, raw):
+        if not cls:
+            return literal_eval(raw)
+        return _load(cls)(raw)
+
+    def error(self, cls, raw):
+        """
+            Return the exception of a recorded error.
+        """
+        names = cls.split()
+        if len(names) > 1:
+            return _load(names[0])(_load(names[1])(raw))
+        return _load(names[0])()
+
+    def reply(self, key):
+        q = self.replies.get(key)
+        if not q:
+            self.missing += 1
+            logger.debug('no recorded reply for %s'%key)
+            return None
+        cls, raw, error = q.popleft() if len(q) > 1 else q[0]
+        if error:
+            raise self.error(cls, raw)
+        return self._decode(cls, raw)
+
+    def event(self, raw):
+        if isinstance(raw, tuple):
+            raise self.error(*raw)
+        cls = self.classes.get(ord(raw[0]) & 0x7f)
+        if cls is None:
+            return xcb.Event(raw)
+        return cls(raw)
+
+
+class ReplayConnection(object):
+    """
+        Stands in for an xcb connection, serving a Replay. Events are handed
+        out one recorded drain at a time: poll_for_event returns None at the
+        end of a drain until next_drain() is called.
+    """
+    def __init__(self, replay):
+        self.replay = replay
+        self.core = _ReplayExtension(replay, '')
+        self.pref_screen = replay.reply(_key('pref_screen', ()))
+        self.pending = deque()
+        self.drain_index = 0
+
+    def __call__(self, key):
+        return _ReplayExtension(self.replay, _extension_name(key) + '.')
+
+    def get_setup(self):
+        return self.replay.reply(_key('get_setup', ()))
+
+    def next_drain(self):
+        """
+            Queue the events of the next recorded drain. Returns False when
+            the recording is exhausted.
+        """
+        if self.drain_index >= len(self.replay.drains):
+            return False
+        self.pending.extend(self.replay.drains[self.drain_index])
+        self.drain_index += 1
+        return True
+
+    def poll_for_event(self):
+        if self.pending:
+            return self.replay.event(self.pending.popleft())
+        return None
+
+    def generate_id(self):
+        return self.replay.reply(_key('generate_id', ()))
+
+    def flush(self):
+        pass
+
+    def get_file_descriptor(self):
+        return -1
+
+    def disconnect(self):
+        pass
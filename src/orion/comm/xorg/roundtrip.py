@@ -0,0 +1,102 @@
+from suppress import sequence
+
+
+class _Cookie(object):
+    """
+        A request cookie remembering how many flushes the connection had
+        made when the request was issued, and the request's 16 bit sequence
+        number.
+    """
+    __slots__ = ('cookie', 'conn', 'epoch', 'sequence', 'counted')
+
+    def __init__(self, cookie, conn, seq):
+        self.cookie = cookie
+        self.conn = conn
+        self.epoch = conn.counter.flushes
+        # the connection's own, when it tells it (headless)
+        own = getattr(cookie, 'sequence', None)
+        self.counted = own is None
+        self.sequence = seq if self.counted else own
+
+    def reply(self):
+        conn = self.conn
+        counter = conn.counter
+        if counter.flushes == self.epoch:
+            # the request has not been sent yet, xcb flushes to get the reply
+            counter.implicit_flush()
+        r = self.cookie.reply()
+        if self.counted and r is not None:
+            conn.resync(self.sequence, sequence(r))
+        return r
+
+    def check(self):
+        return self.cookie.check()
+
+    def __getattr__(self, name):
+        return getattr(self.cookie, name)
+
+
+class _Requests(object):
+    """
+        An extension of a CountingConnection (its core, or conn(key)):
+        requests return cookies which count the flushes their replies force
+        and know their sequence number.
+    """
+    def __init__(self, ext, conn):
+        self.ext = ext
+        self.conn = conn
+
+    def __getattr__(self, name):
+        request = getattr(self.ext, name)
+        conn = self.conn
+        def f(*args):
+            cookie = request(*args)
+            conn.sequence += 1
+            return _Cookie(cookie, conn, conn.sequence & 0xffff)
+        # looked up once per request type
+        setattr(self, name, f)
+        return f
+
+
+class CountingConnection(object):
+    """
+        Wraps an xcb connection to tell the flushes done by reading a reply
+        from the explicit ones, and to number the requests. xcb writes its
+        output buffer whenever a reply is read for a request which was not
+        flushed yet; counter (the Xorg) is told about those through
+        implicit_flush().
+
+        counter.flushes is the number of flushes so far, explicit or not;
+        a request issued after the last one is still unsent.
+
+        xpyb cookies do not tell the sequence number of their request, so
+        the requests made through the connection are counted. xcb sends a
+        few requests of its own (extension queries, syncs); every reply
+        read corrects the count with the sequence number it carries.
+    """
+    def __init__(self, conn, counter):
+        self.conn = conn
+        self.counter = counter
+        # sequence number of the last request
+        self.sequence = 0
+        self.resyncs = 0
+        self.core = _Requests(conn.core, self)
+
+    def __call__(self, key):
+        return _Requests(self.conn(key), self)
+
+    def resync(self, counted, actual):
+        """
+            The request numbered counted turned out to be actual.
+        """
+        delta = (actual - counted) & 0xffff
+        if delta:
+            if delta >= 0x8000:
+                delta -= 0x10000
+            self.sequence += delta
+            self.resyncs += 1
+
+    def __getattr__(self, name):
+        value = getattr(self.conn, name)
+        setattr(self, name, value)
+        return value
@@ -0,0 +1,141 @@
+import logging
+logger = logging.getLogger(__name__)
+
+# ConfigureWindow arguments which describe state; stackmode and sibling
+# are operations and always sent
+GEOMETRY = ('x', 'y', 'width', 'height', 'borderwidth')
+# ChangeWindowAttributes arguments we keep track of
+ATTRIBUTES = ('borderpixel', 'eventmask')
+
+
+class _Shadow(object):
+    __slots__ = ('config', 'attrs', 'mapped')
+
+    def __init__(self):
+        self.config = {}
+        self.attrs = {}
+        # None while unknown
+        self.mapped = None
+
+
+class ShadowState(object):
+    """
+        The geometry, border pixel, event mask and map state we last set on
+        each window, used to drop requests which would not change anything.
+
+        The shadow is only ever filled from our own requests. Notify events
+        can only make it forget: a field which disagrees with an event (the
+        event may be older than our last request, or the client changed the
+        window itself) becomes unknown, and the next request for it is sent.
+        So a dropped request is always one the server state already
+        satisfies.
+    """
+    def __init__(self):
+        self.windows = {}
+        self.sent = 0
+        self.saved = 0
+        self.relayouts = 0
+        self.last_relayout = (0, 0)
+        self._relayout_start = None
+
+    def _get(self, wid):
+        s = self.windows.get(wid)
+        if s is None:
+            s = self.windows[wid] = _Shadow()
+        return s
+
+    def configure(self, wid, kwargs):
+        """
+            Return the part of a ConfigureWindow which changes something, or
+            None if it can be dropped.
+        """
+        config = self._get(wid).config
+        changed = {}
+        for k, v in kwargs.iteritems():
+            if v is None:
+                # not part of the request
+                continue
+            if k not in GEOMETRY or config.get(k) != v:
+                changed[k] = v
+        if not changed:
+            self.saved += 1
+            return None
+        for k in GEOMETRY:
+            if k in changed:
+                config[k] = changed[k]
+        self.sent += 1
+        return changed
+
+    def attributes(self, wid, kwargs):
+        """
+            Return the part of a ChangeWindowAttributes which changes
+            something, or None if it can be dropped.
+        """
+        attrs = self._get(wid).attrs
+        changed = {}
+        for k, v in kwargs.iteritems():
+            if v is None:
+                # not part of the request
+                continue
+            if k not in ATTRIBUTES or attrs.get(k) != v:
+                changed[k] = v
+        if not changed:
+            self.saved += 1
+            return None
+        for k in ATTRIBUTES:
+            if k in changed:
+                attrs[k] = changed[k]
+        self.sent += 1
+        return changed
+
+    def map(self, wid, mapped):
+        """
+            Return whether a MapWindow (mapped) or UnmapWindow needs to be
+            sent.
+        """
+        s = self._get(wid)
+        if s.mapped == mapped:
+            self.saved += 1
+            return False
+        s.mapped = mapped
+        self.sent += 1
+        return True
+
+    def configure_notify(self, e):
+        s = self.windows.get(e.window)
+        if s is None:
+            return
+        config = s.config
+        for k, v in (('x', e.x), ('y', e.y), ('width', e.width),
+                     ('height', e.height), ('borderwidth', e.border_width)):
+            if k in config and config[k] != v:
+                del config[k]
+
+    def map_notify(self, wid, mapped):
+        s = self.windows.get(wid)
+        if s is not None and s.mapped != mapped:
+            s.mapped = None
+
+    def forget(self, wid):
+        self.windows.pop(wid, None)
+
+    def begin_relayout(self):
+        self._relayout_start = (self.sent, self.saved)
+
+    def end_relayout(self):
+        if self._relayout_start is None:
+            return
+        sent, saved = self._relayout_start
+        self._relayout_start = None
+        self.relayouts += 1
+        self.last_relayout = (self.sent - sent, self.saved - saved)
+
+    def stats(self):
+        return dict(
+            windows = len(self.windows),
+            sent = self.sent,
+            saved = self.saved,
+            relayouts = self.relayouts,
+            last_relayout_sent = self.last_relayout[0],
+            last_relayout_saved = self.last_relayout[1],
+        )
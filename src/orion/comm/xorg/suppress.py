@@ -0,0 +1,157 @@
+import struct
+
+import logging
+logger = logging.getLogger(__name__)
+
+SEQUENCE = struct.Struct('=H')
+
+
+def sequence(obj):
+    """
+        The 16 bit sequence number of an event or reply.
+    """
+    seq = getattr(obj, 'sequence', None)
+    if seq is None:
+        # xpyb does not unpack it, it is the second field of every event
+        # and reply
+        seq = SEQUENCE.unpack_from(buffer(obj), 2)[0]
+    return seq & 0xffff
+
+
+def _serial(cookie):
+    """
+        The sequence number of the request of cookie. Unless the
+        connection told it (headless), it is read from the reply, which
+        xcb keeps until then, rather than from the count of a
+        CountingConnection, which may lag behind xcb's own requests.
+    """
+    serial = getattr(cookie, 'sequence', None)
+    if serial is None or getattr(cookie, 'counted', False):
+        serial = sequence(cookie.reply())
+    return serial & 0xffff
+
+
+class _Mark(object):
+    """
+        The rules of one cycle and the two markers around the requests they
+        are about.
+    """
+    __slots__ = ('rules', 'start', 'end', 'first', 'last', 'drains')
+
+    def __init__(self, start, drains):
+        # (code, wid) rules, wid None for any window
+        self.rules = set()
+        self.start = start
+        self.end = None
+        self.first = None
+        self.last = None
+        self.drains = drains
+
+    def resolve(self):
+        if self.first is None:
+            self.first = _serial(self.start)
+            self.last = _serial(self.end)
+            self.start = self.end = None
+
+    def covers(self, seq):
+        """
+            Whether an event with sequence number seq (that of the last
+            request processed when it was generated) was caused by a request
+            between the markers, modulo 2**16.
+        """
+        return 0 < (seq - self.first) & 0xffff < (self.last - self.first) & 0xffff
+
+
+class EventSuppressor(object):
+    """
+        Drops events caused by our own requests, such as the EnterNotify a
+        relayout generates when windows move under the pointer, without
+        touching any event mask.
+
+        ignore(code, wid) asks to drop events of type code (for window wid,
+        or any window) caused by the requests sent from now to the end of
+        the cycle; it has to be called before those requests. The first
+        ignore of a cycle sends a start marker request (GetInputFocus), and
+        at the end of the cycle mark() sends an end marker. Every event
+        generated while the server processed the requests in between
+        carries a sequence number between those of the markers. The markers'
+        sequence numbers are only looked up when an event which may have to
+        be dropped arrives.
+
+        Each cycle's rules are kept with their own markers and dropped one
+        drain after they were resolved, when all the events older than the
+        end marker have been dispatched, or after drains drains otherwise.
+    """
+    def __init__(self, conn, drains=4):
+        self.conn = conn
+        self.drains = drains
+        # the _Mark of the current cycle, if ignore was called
+        self.current = None
+        # _Marks waiting for their events
+        self.marks = []
+        self.markers = 0
+        self.suppressed = 0
+
+    def ignore(self, code, wid=None):
+        if self.current is None:
+            self.current = _Mark(self.conn.conn.core.GetInputFocus(), self.drains)
+        self.current.rules.add((code, wid))
+
+    def mark(self):
+        """
+            Send the end marker for the rules added in this cycle.
+        """
+        m = self.current
+        if m is None:
+            return
+        self.current = None
+        m.end = self.conn.conn.core.GetInputFocus()
+        self.marks.append(m)
+        self.markers += 1
+
+    def suppress(self, code, wid, e):
+        """
+            Return whether the event e of type code for window wid has to be
+            dropped.
+        """
+        if not self.marks:
+            return False
+        for m in self.marks:
+            rules = m.rules
+            if (code, None) not in rules and (code, wid) not in rules:
+                continue
+            if m.first is None:
+                m.resolve()
+                # reading the end marker queued the events before it, the
+                # drain after this one dispatches them
+                m.drains = min(m.drains, 2)
+            if m.covers(sequence(e)):
+                self.suppressed += 1
+                return True
+        return False
+
+    def end_drain(self):
+        """
+            Called after every drain, drops the marks whose events have all
+            been seen.
+        """
+        if not self.marks:
+            return
+        kept = []
+        for m in self.marks:
+            m.drains -= 1
+            if m.drains > 0:
+                kept.append(m)
+            else:
+                # read the marker replies, xcb keeps them until then
+                m.resolve()
+        self.marks = kept
+
+    def stats(self):
+        return dict(
+            markers = self.markers,
+            suppressed = self.suppressed,
+            marks = len(self.marks),
+            rules = sum(len(m.rules) for m in self.marks) +
+                    (len(self.current.rules) if self.current else 0),
+        )
@@ -3,20 +3,36 @@ from pyutilib.component.core import implements, SingletonPlugin
 from orion.comm.api import IDisplayServerCommunicator
 from ext.api import IXorgExtension
 
-import struct
+import os, struct
+from array import array
 import xcb.xproto, xcb.xinerama, xcb.randr, xcb.xcb
 from xcb.xproto import CW, WindowClass, EventMask
 from orion import utils
-from keyboard import xkeysyms
 
 from orion.wm.window import proto
 from orion.wm.window import icccm
 from orion.comm.xorg import keyboard
+from orion.comm.xorg.keyboard.keymap import Keymap
 
 from orion.wm.window.window import Window
 from atom import AtomCache
+import dispatch
+from coalesce import EventCoalescer
+from batch import RequestBatch
+from grab import GrabManager
+from propcache import PropertyCache
+from shadow import ShadowState
+from suppress import EventSuppressor
+from errors import ErrorRouter
+from roundtrip import CountingConnection
+from color import Colormap
+import record
 from orion.utils import typedPack
-from orion.signals import Signal
+from orion.signals import Signal, SignalRouter
+from orion import signals
+
+import logging
+logger = logging.getLogger(__name__)
 
 class _Wrapper:
     def __init__(self, wrapped):
@@ -32,30 +48,36 @@ class XScreen(_Wrapper):
     """
     def __init__(self, conn, screen):
         _Wrapper.__init__(self, screen)
-        self.default_colormap = Colormap(conn, screen.default_colormap)
+        self.root_visual_type = self.find_visual(screen.root_visual)
+        self.default_colormap = Colormap(conn, screen.default_colormap,
+                                         self.root_visual_type)
         self.root = Window(conn, self.root)
 
+    def find_visual(self, visual_id):
+        for i in self.allowed_depths:
+            for v in i.visuals:
+                if v.visual_id == visual_id:
+                    return v
 
 
-class Colormap:
-    def __init__(self, conn, cid):
-        self.conn, self.cid = conn, cid
 
-    def alloc_color(self, color):
-        """
-            Flexible color allocation.
-        """
-        if color.startswith("#"):
-            if len(color) != 7:
-                raise ValueError("Invalid color: %s"%color)
-            def x8to16(i):
-                return 0xffff * (i&0xff)/0xff
-            r = x8to16(int(color[1] + color[2], 16))
-            g = x8to16(int(color[3] + color[4], 16))
-            b = x8to16(int(color[5] + color[6], 16))
-            return self.conn.conn.core.AllocColor(self.cid, r, g, b).reply()
-        else:
-            return self.conn.conn.core.AllocNamedColor(self.cid, len(color), color).reply()
+# the signals of Xorg.events which are about a window
+WINDOW_SIGNALS = (
+    'create_notify',
+    'destroy_notify',
+    'message',
+    'configure_request',
+    'map_request',
+    'property_notify',
+    'configure_notify',
+    'map_notify',
+    'unmap',
+    'leave_notify',
+    'focus_in',
+    'focus_out',
+    'enter',
+)
+
 
 class Xorg(SingletonPlugin):
     implements(IDisplayServerCommunicator)
@@ -82,11 +104,47 @@ class Xorg(SingletonPlugin):
             'focus_in',
             'focus_out',
             'enter',
+            'mapping_notify',
+            'outputs_change',
             type = Signal
         )
+        # per window subscriptions to the window events, see subscribe
+        self.routes = SignalRouter(*WINDOW_SIGNALS)
+        self.properties = PropertyCache(self)
+        self.shadow = ShadowState()
+        self.suppressor = EventSuppressor(self)
+        self.errors = ErrorRouter()
+        self.dispatcher = self._build_dispatcher()
+        self.coalescer = EventCoalescer()
+        self.grabs = GrabManager(self)
+        self.after_drain = []
+        # number of events dispatched by the last xpoll
+        self.last_drain = 0
+        # events polled but not dispatched yet, see has_events
+        self.held = []
+        # flush accounting, see end_cycle
+        self.cycles = 0
+        self.flushes = 0
+        # flushes done by xcb to read a reply, see CountingConnection
+        self.implicit_flushes = 0
+        self.cycle_flushes = 0
+        self.flush_histogram = {}
     
+    def connect(self, display):
+        """
+            Return the connection to the display server.
+        """
+        replay = os.environ.get('ORION_REPLAY')
+        if replay:
+            return record.ReplayConnection(record.Replay(replay))
+        return xcb.xcb.connect(display=display)
+
     def init(self, display):
-        self.conn = xcb.xcb.connect(display=display)
+        self.conn = self.connect(display)
+        path = os.environ.get('ORION_RECORD')
+        if path:
+            self.conn = record.RecordingConnection(self.conn, record.Recorder(path))
+        self.conn = CountingConnection(self.conn, self)
         self.setup = self.conn.get_setup()
         self.keyboard = keyboard
         
@@ -99,24 +157,29 @@ class Xorg(SingletonPlugin):
         self.screens = [XScreen(self, i) for i in self.setup.roots]
         self.__extensions = ExtensionPoint(IXorgExtension)
         
-        # check for xinerama and randr screens        
+        # check for randr and xinerama screens, randr is preferred since
+        # it notifies us about monitor changes
         self.pseudoscreens = []
-        extension = self.extensions.service('xinerama')
-        if "xinerama" in self.extension_list:
-            extension = self.extensions.service('xinerama')
-        if not extension and "randr" in self.extension_list:
+        # whether monitor changes are emitted as outputs_change
+        self.outputs_notify = False
+        extension = None
+        if "randr" in self.extension_list:
             extension = self.extensions.service('randr')
+        if not extension and "xinerama" in self.extension_list:
+            extension = self.extensions.service('xinerama')
         if extension:
             extension.init(self)
             self.pseudoscreens = extension.query_screens()
+            self.outputs_notify = extension.notifies
 
         self.default_screen = self.screens[self.conn.pref_screen]
+        # start from no grabs on the root, whoever made them
+        self.grabs.reset(self.default_screen.root.wid)
         
         self.atoms = AtomCache(self)
 
         # compute keycodes
-        self.code_to_syms     = None
-        self.first_sym_to_code = None
+        self.keymap = Keymap(self.setup.min_keycode, self.setup.max_keycode)
         self.refresh_keymap()
 
         # get modifier mapping
@@ -128,55 +191,64 @@ class Xorg(SingletonPlugin):
         self.xpoll()
 
     def refresh_keymap(self, first=None, count=None):
+        """
+            Fetch the keysyms of count keycodes starting at first, or of the
+            whole keycode range if first is None, and patch them into the
+            keymap.
+        """
         if first is None:
             first = self.setup.min_keycode
             count = self.setup.max_keycode - self.setup.min_keycode + 1
         q = self.conn.core.GetKeyboardMapping(first, count).reply()
-        
-        self.code_to_syms = {}
-        l = []
-        for i, v in enumerate(q.keysyms):
-            if not i%q.keysyms_per_keycode:
-                if l:
-                    self.code_to_syms[(i/q.keysyms_per_keycode) + first - 1] = l
-                l = []
-                l.append(v)
-            else:
-                l.append(v)
-        assert len(l) == q.keysyms_per_keycode
-        self.code_to_syms[first + count - 1] = l
-
-        first_sym_to_code = {}
-        for k, s in self.code_to_syms.items():
-            first_sym_to_code[s[0]] = k
-
-        self.first_sym_to_code = first_sym_to_code
+        self.keymap.update(first, q.keysyms_per_keycode, q.keysyms)
 
     def refresh_modmap(self):
+        """
+            Fetch the modifier mapping. Besides the modifier -> keycodes map
+            this builds the inverse keycode -> modifier tables and a
+            modifier -> keycodes bitset, so lookups are constant-time.
+        """
         q = self.conn.core.GetModifierMapping().reply()
         modmap = {}
+        keycode_modifier = [None] * 256
+        keycode_modmask = array('B', [0]) * 256
+        modifier_keycodes = {}
         mods = keyboard.modmasks.keys()
         for i, k in enumerate(q.keycodes):
-            l = modmap.setdefault(mods[i/q.keycodes_per_modifier], [])
+            name = mods[i/q.keycodes_per_modifier]
+            l = modmap.setdefault(name, [])
             l.append(k)
+            if not k:
+                continue
+            if keycode_modifier[k] is None:
+                keycode_modifier[k] = name
+            keycode_modmask[k] |= keyboard.modmasks[name]
+            modifier_keycodes[name] = modifier_keycodes.get(name, 0) | (1 << k)
         self.modmap = modmap
+        self.keycode_modifier = keycode_modifier
+        self.keycode_modmask = keycode_modmask
+        self.modifier_keycodes = modifier_keycodes
 
     def get_modifier(self, keycode):
         """
             Return the modifier matching keycode.
         """
-        for n, l in self.modmap.items():
-            if keycode in l:
-                return n
-        return None
+        return self.keycode_modifier[keycode]
+
+    def get_modifier_mask(self, keycode):
+        """
+            Return the mask of all modifiers keycode is mapped to, or 0.
+        """
+        return self.keycode_modmask[keycode]
+
+    def is_modifier(self, keycode, modifier):
+        return bool(self.modifier_keycodes.get(modifier, 0) >> keycode & 1)
 
     def keysym_to_keycode(self, keysym):
-        return self.first_sym_to_code.get(keysym, 0)
+        return self.keymap.keysym_to_keycode(keysym)
 
     def keycode_to_keysym(self, keycode, modifier):
-        if keycode >= len(self.code_to_syms) or modifier >= len(self.code_to_syms[keycode]):
-            return 0
-        return self.code_to_syms[keycode][modifier]
+        return self.keymap.keycode_to_keysym(keycode, modifier)
 
     def create_window(self, x, y, width, height):
         wid = self.conn.generate_id()
@@ -196,14 +268,89 @@ class Xorg(SingletonPlugin):
         return Window(self, wid)
 
     def flush(self):
+        """
+            Send the queued requests now. Requests are normally sent once
+            per cycle by end_cycle; only code which needs the server to act
+            before the cycle ends (e.g. before reading replies) flushes.
+        """
+        self.flushes += 1
+        self.cycle_flushes += 1
         return self.conn.flush()
 
+    def implicit_flush(self):
+        """
+            Count the flush xcb does when a reply of an unsent request is
+            read.
+        """
+        self.flushes += 1
+        self.cycle_flushes += 1
+        self.implicit_flushes += 1
+
+    def end_cycle(self):
+        """
+            End an event drain or command cycle: run the deferred calls
+            (orion.signals.deferred), send all the requests the cycle
+            produced, including pending grab changes, with a single flush and
+            record the number of flushes the cycle needed, counting those
+            forced by reading replies.
+
+            Replies read during the cycle (e.g. by deferred relayouts) may
+            have queued events in xcb, which do not make the connection
+            readable; they are dispatched, in a cycle of their own, before
+            returning. last_drain then counts them too.
+        """
+        while True:
+            signals.deferred.run()
+            if self.grabs.dirty:
+                self.grabs.sync()
+            self.suppressor.mark()
+            self.flush()
+            n = self.cycle_flushes
+            self.flush_histogram[n] = self.flush_histogram.get(n, 0) + 1
+            self.cycles += 1
+            self.cycle_flushes = 0
+            if not self.has_events():
+                return
+            drained = self.last_drain
+            self.xpoll()
+            self.last_drain += drained
+
+    def has_events(self):
+        """
+            Return whether events are waiting, in xcb's queue or on the
+            socket. They are kept for the next xpoll.
+        """
+        if not self.held:
+            self.held = self._poll_events()
+        return bool(self.held)
+
+    def flush_stats(self):
+        """
+            Return the flush counters: the number of cycles and flushes, how
+            many of those were forced by reading a reply, and a flushes per
+            cycle -> cycles histogram.
+        """
+        return dict(
+            cycles = self.cycles,
+            flushes = self.flushes,
+            implicit = self.implicit_flushes,
+            per_cycle = float(self.flushes) / max(self.cycles, 1),
+            histogram = dict(self.flush_histogram),
+        )
+
     def xsync(self):
         # The idea here is that pushing an innocuous request through
         # the queue and waiting for a response "syncs" the connection, since
         # requests are serviced in order.
         self.conn.core.GetInputFocus().reply()
 
+    def batch(self):
+        """
+            Return a new RequestBatch. Requests queued in it are resolved
+            together in a single round trip.
+        """
+        return RequestBatch(self)
+
     def grab_server(self):
         return self.conn.core.GrabServer()
 
@@ -216,22 +363,16 @@ class Xorg(SingletonPlugin):
         return Font(self, fid)
     
     def grab_key(self, wid, key, modifiers=[]):
-        pointer_mode = xcb.xproto.GrabMode.Async
-        keyboard_mode = xcb.xproto.GrabMode.Async
-        keysym = keyboard.keysyms[key]
-        keycode = self.keysym_to_keycode(keysym)
-        modmask = keyboard.modmasks.mask(modifiers)
-        
-        owner_events = True
-        self.conn.core.GrabKey(
-            owner_events,
-            wid,
-            modmask,
-            keycode,
-            pointer_mode,
-            keyboard_mode
-        )
-        self.flush()
+        """
+            Bind key with modifiers on window wid. The grabs are sent with
+            all the other grab changes at the end of the cycle.
+        """
+        self.grabs.add_key(wid, keyboard.keysyms[key],
+                           keyboard.modmasks.mask(modifiers))
+
+    def ungrab_key(self, wid, key, modifiers=[]):
+        self.grabs.remove_key(wid, keyboard.keysyms[key],
+                              keyboard.modmasks.mask(modifiers))
 
     @property
     def extension_list(self):
@@ -241,101 +382,189 @@ class Xorg(SingletonPlugin):
     def extensions(self):
         return self.__extensions
     
+    def _build_dispatcher(self):
+        """
+            Prebuild the response_type -> handler table used by xpoll.
+        """
+        events = self.events
+        route = self.routes.emit
+        def window_handler(name):
+            signal = getattr(events, name)
+            def handler(e):
+                signal(self, wid=e.window)
+                route(name, self, e.window)
+            return handler
+        suppress = self.suppressor.suppress
+        def crossing_handler(name, code):
+            signal = getattr(events, name)
+            def handler(e):
+                if not suppress(code, e.event, e):
+                    signal(self, wid=e.event)
+                    route(name, self, e.event)
+            return handler
+        def key_handler(signal):
+            def handler(e):
+                keysym = self.keymap.keycode_to_keysym(e.detail)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('key %s (keycode %s, state %s)'%(
+                        keyboard.keysyms.name(keysym), e.detail, e.state))
+                signal(self,
+                    keycode = keysym,
+                    wid = None,
+                )
+            return handler
+        properties = self.properties
+        def property_handler(e):
+            properties.invalidate(e.window, e.atom)
+            events.property_notify(self, wid=e.window, atom=e.atom)
+            route('property_notify', self, e.window, e.atom, atom=e.atom)
+        shadow = self.shadow
+        routes = self.routes
+        def destroy_handler(e):
+            properties.forget(e.window)
+            shadow.forget(e.window)
+            events.destroy_notify(self, wid=e.window)
+            route('destroy_notify', self, e.window)
+            routes.forget(e.window)
+        def configure_request_handler(e):
+            events.configure_request(self, wid=e.window)
+            route('configure_request', self, e.window,
+                value_mask = e.value_mask,
+                x = e.x,
+                y = e.y,
+                width = e.width,
+                height = e.height,
+                border_width = e.border_width,
+            )
+        def configure_handler(e):
+            shadow.configure_notify(e)
+            events.configure_notify(self, wid=e.window)
+            route('configure_notify', self, e.window)
+        def map_handler(e):
+            shadow.map_notify(e.window, True)
+            events.map_notify(self, wid=e.window)
+            route('map_notify', self, e.window)
+        def unmap_handler(e):
+            shadow.map_notify(e.window, False)
+            if not suppress(dispatch.UnmapNotify, e.window, e):
+                events.unmap(self, wid=e.window)
+                route('unmap', self, e.window)
+        def mapping_handler(e):
+            if e.request == xcb.xproto.Mapping.Keyboard:
+                self.refresh_keymap(e.first_keycode, e.count)
+            elif e.request == xcb.xproto.Mapping.Modifier:
+                self.refresh_modmap()
+            # keycodes or lock masks of the bindings may have changed
+            self.grabs.dirty = True
+            events.mapping_notify(self,
+                request = e.request,
+                first_keycode = e.first_keycode,
+                count = e.count,
+            )
+
+        d = dispatch.EventDispatcher()
+        d.register(dispatch.KeyPress,         key_handler(events.key_press))
+        d.register(dispatch.KeyRelease,       key_handler(events.key_release))
+        d.register(dispatch.CreateNotify,     window_handler('create_notify'))
+        d.register(dispatch.DestroyNotify,    destroy_handler)
+        d.register(dispatch.ClientMessage,    window_handler('message'))
+        d.register(dispatch.ConfigureRequest, configure_request_handler)
+        d.register(dispatch.MapRequest,       window_handler('map_request'))
+        d.register(dispatch.PropertyNotify,   property_handler)
+        d.register(dispatch.ConfigureNotify,  configure_handler)
+        d.register(dispatch.MapNotify,        map_handler)
+        d.register(dispatch.UnmapNotify,      unmap_handler)
+        d.register(dispatch.LeaveNotify,      crossing_handler('leave_notify', dispatch.LeaveNotify))
+        d.register(dispatch.FocusIn,          crossing_handler('focus_in', dispatch.FocusIn))
+        d.register(dispatch.FocusOut,         crossing_handler('focus_out', dispatch.FocusOut))
+        d.register(dispatch.EnterNotify,      crossing_handler('enter', dispatch.EnterNotify))
+        d.register(dispatch.MappingNotify,    mapping_handler)
+        return d
+
     def xpoll(self, conn=None, cond=None):
-        eventEvents = [
-            "EnterNotifyEvent",
-            "ButtonPressEvent",
-            "ButtonReleaseEvent",
-            "KeyPressEvent",
-        ]
-        
+        """
+            Dispatch the pending events, in batches, until none is left.
+
+            A handler or after_drain callback reading a reply makes xcb read
+            the socket, and the events which arrived meanwhile wait in xcb's
+            queue, where they do not make the connection readable again; so
+            the connection is polled again after every batch.
+        """
+        handle = self.dispatcher.dispatch
+        total = 0
         while True:
-            e = self.conn.poll_for_event()
-            if not e:
+            events = self._poll_events()
+            if events:
+                total += len(events)
+                try:
+                    for e in self.coalescer.coalesce(events):
+                        # a failing handler must not lose the rest of the drain
+                        try:
+                            handle(e)
+                        except Exception:
+                            logger.exception('handling %s failed'%type(e).__name__)
+                finally:
+                    self.suppressor.end_drain()
+                continue
+            if not self.after_drain:
                 break
-            # This should be done in xpyb
-            # client mesages start at 128
-            if e.response_type >= 128:
-                e = xcb.xproto.ClientMessageEvent(e)
-
-            e.name = e.__class__.__name__
-            print '>>>>>>>>>>', e.name
-             
-            if not e.__class__ in []:#self.ignoreEvents:
-                window = None
-                if hasattr(e, "window"):
-                    print '[1]'
-                    window = e.window
-                elif hasattr(e, "drawable"):
-                    print '[2]'
-                    window = e.drawable
-                elif e.name in eventEvents:
-                    print '[3]'
-                    window = e.event
-                else:
-                    print '[4]'
-                
-            if e.name == 'KeyPressEvent':
-                self.events.key_press(self,
-                    keycode = self.code_to_syms[e.detail][0],
-                    wid = None,
-                )
-                import subprocess
-                subprocess.Popen('gnome-terminal')
-            elif e.name == 'KeyReleaseEvent':
-                self.events.key_release(self,
-                    keycode = self.code_to_syms[e.detail][0],
-                    wid = None,
-                )
-            elif e.name == 'CreateNotifyEvent':
-                self.events.create_notify(self,
-                    wid = e.window,
-                )
-            elif e.name == 'DestroyNotifyEvent':
-                self.events.destroy_notify(self,
-                    wid = e.window,
-                )
-            elif e.name == 'ClientMessageEvent':
-                self.events.message(self,
-                    wid = e.window,
-                )
-            elif e.name == 'ConfigureRequestEvent':
-                self.events.configure_request(self,
-                    wid = e.window,
-                )
-            elif e.name == 'MapRequestEvent':
-                self.events.map_request(self,
-                    wid = e.window,
-                )
-            elif e.name == 'PropertyNotifyEvent':
-                self.events.property_notify(self,
-                    wid = e.window
-                )
-            elif e.name == 'ConfigureNotifyEvent':
-                self.events.configure_notify(self,
-                    wid = e.window
-                )
-            elif e.name == 'MapNotifyEvent':
-                self.events.map_notify(self,
-                    wid = e.window
-                )
-            elif e.name == 'LeaveNotifyEvent':
-                self.events.leave_notify(self,
-                    wid = e.event
-                )
-            elif e.name == 'FocusInEvent':
-                self.events.focus_in(self,
-                    wid = e.event
-                )
-            elif e.name == 'FocusOutEvent':
-                self.events.focus_out(self,
-                    wid = e.event
-                )
-            elif e.name == 'EnterNotifyEvent':
-                self.events.enter(self,
-                    wid = e.event
-                )
-            else:
-                print 'UNKNOWN EVENT: ', e.name
-                
-        return True
\ No newline at end of file
+            callbacks, self.after_drain = self.after_drain, []
+            for f in callbacks:
+                try:
+                    f()
+                except Exception:
+                    logger.exception('after drain call of %r failed'%(f,))
+        self.last_drain = total
+        return True
+
+    def _poll_events(self):
+        """
+            Return the events xcb has, queued or on the socket.
+        """
+        events, self.held = self.held, []
+        poll = self.conn.poll_for_event
+        while True:
+            try:
+                e = poll()
+            except xcb.ProtocolException, error:
+                # errors of unchecked requests come with the events
+                self.route_error(error)
+                continue
+            if not e:
+                return events
+            events.append(e)
+
+    def subscribe(self, name, slot, wid, prop=None):
+        """
+            Connect slot to the name events (one of WINDOW_SIGNALS) of
+            window wid only; for property_notify, prop narrows it down to
+            one property name.
+
+                conn.subscribe('property_notify', slot, 0x1a00003, '_NET_WM_NAME')
+        """
+        atom = self.atoms[prop] if prop is not None else None
+        self.routes.connect(name, slot, wid, atom)
+
+    def unsubscribe(self, name, slot, wid, prop=None):
+        atom = self.atoms[prop] if prop is not None else None
+        self.routes.disconnect(name, slot, wid, atom)
+
+    def route_error(self, error):
+        """
+            Handle the X error of an unchecked request.
+        """
+        wid, op = self.errors.route(error)
+        if wid is not None and isinstance(error,
+                (xcb.xproto.BadWindow, xcb.xproto.BadDrawable)):
+            # the window is gone and its DestroyNotify is on the way, just
+            # drop what we know about it
+            self.properties.forget(wid)
+            self.shadow.forget(wid)
+
+    def call_after_drain(self, f):
+        """
+            Call f once after all the events of the current xpoll iteration
+            have been dispatched.
+        """
+        if f not in self.after_drain:
+            self.after_drain.append(f)
@@ -1,9 +1,170 @@
+"""
+    The hook bus.
+
+        hook.subscribe.client_killed(f)
+        hook.subscribe.focus_change(f, deferred=True)
+        hook.fire("client_killed", window)
+
+    Hooks are identified by name and created on first use. Subscribers of
+    a hook are called in the order they subscribed; bound methods are held
+    weakly, so subscribing does not keep their object alive. A deferred
+    subscriber runs at most once per loop iteration, with the arguments of
+    the last fire (see orion.signals.deferred), even when it is subscribed
+    to several hooks which fire in that iteration; calls with the same key=
+    are merged too. Every hook counts its fires and the time its
+    subscribers took, and remembers the slowest one (stats).
+"""
+import time, inspect
 from orion.utils import pack
 
 import logging
 logger = logging.getLogger(__name__)
 
-from orion.signals import Signal, SignalGroup
+from orion.signals import Signal, SignalGroup, WeakMethod
+from orion import signals
+
+
+def _ident(func):
+    """
+        What identifies func among the subscribers of a hook. A bound method
+        is a new object on every attribute access, so it is identified by
+        its object and function.
+    """
+    if inspect.ismethod(func) and func.im_self is not None:
+        return (id(func.im_self), func.im_func)
+    return func
+
+
+class Hook(object):
+    """
+        One channel of the bus.
+    """
+    __slots__ = ('name', 'subscribers', 'calls', 'time', 'slowest', 'slowest_time')
+
+    def __init__(self, name):
+        self.name = name
+        # (ident, func or WeakMethod, priority, key), priority is None
+        # unless deferred
+        self.subscribers = ()
+        self.calls = 0
+        self.time = 0.0
+        self.slowest = None
+        self.slowest_time = 0.0
+
+    def subscribe(self, func, deferred=False, priority=0, key=None):
+        """
+            Subscribe func; a deferred one is merged with the other deferred
+            calls of key, by default func itself.
+        """
+        ident = _ident(func)
+        self._remove(ident)
+        slot = func
+        if inspect.ismethod(func) and func.im_self is not None:
+            slot = WeakMethod(func, lambda wr: self._remove(ident))
+        if key is None:
+            key = ident
+        self.subscribers += ((ident, slot, priority if deferred else None, key),)
+        return func
+
+    def unsubscribe(self, func):
+        self._remove(_ident(func))
+
+    def _remove(self, ident):
+        self.subscribers = tuple(s for s in self.subscribers if s[0] != ident)
+
+    def fire(self, *args, **kwargs):
+        self.calls += 1
+        for ident, func, priority, key in self.subscribers:
+            if priority is None:
+                self._run(func, args, kwargs)
+            else:
+                signals.deferred.add(('hook', key), self._run,
+                                     (func, args, kwargs), priority=priority)
+
+    def _run(self, func, args, kwargs):
+        start = time.time()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            logger.exception('subscriber %s of hook %s failed'%(
+                _describe(func), self.name))
+        t = time.time() - start
+        self.time += t
+        if t > self.slowest_time:
+            self.slowest_time = t
+            self.slowest = _describe(func)
+
+    def stats(self):
+        return dict(
+            calls = self.calls,
+            subscribers = len(self.subscribers),
+            time = self.time,
+            slowest = self.slowest,
+            slowest_time = self.slowest_time,
+        )
+
+
+def _describe(func):
+    if isinstance(func, WeakMethod):
+        self, name = func.c(), func.f.__name__
+        if self is None:
+            return '<dead>.%s'%name
+        return '%s.%s'%(type(self).__name__, name)
+    self = getattr(func, 'im_self', None)
+    name = getattr(func, '__name__', None) or repr(func)
+    if self is not None:
+        return '%s.%s'%(type(self).__name__, name)
+    return '%s.%s'%(getattr(func, '__module__', '?'), name)
+
+
+# interned hook name -> Hook
+hooks = {}
+
+def get(name):
+    """
+        Return the hook called name, creating it if needed.
+    """
+    h = hooks.get(name)
+    if h is None:
+        name = intern(name)
+        h = hooks[name] = Hook(name)
+    return h
+
+def fire(name, *args, **kwargs):
+    h = hooks.get(name)
+    if h is None:
+        h = get(name)
+    h.fire(*args, **kwargs)
+
+
+class _Subscribe(object):
+    """
+        hook.subscribe.name(func, deferred=False, priority=0) subscribes
+        func to the hook name.
+    """
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return get(name).subscribe
+
+class _Unsubscribe(object):
+    """
+        hook.unsubscribe.name(func) unsubscribes func from the hook name.
+    """
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return get(name).unsubscribe
+
+subscribe = _Subscribe()
+unsubscribe = _Unsubscribe()
+
+def stats():
+    """
+        Return the counters of every hook, by name.
+    """
+    return dict((name, h.stats()) for name, h in hooks.iteritems())
+
 
 window = SignalGroup(
     'create',        
@@ -31,26 +192,10 @@ screen = SignalGroup(
     'configure_notify',
 )
 
-def test_terminal(e):
-    import subprocess
-    subprocess.Popen('gnome-terminal')
-
-def f(e):
-    print '!!!'
-    print e.target
-    print e.currentTarget
-    
-window.mouse_enter.connect(f)
-screen.key_press.connect(test_terminal)
-
-def manage_window(e):
-    e.window.events.connect_by_name(window)
-    
 def manage_screen(e):
     e.screen.events.connect_by_name(screen)
 
 def init(orion):
     orion.events.window_create.connect(window.create)
-    orion.events.window_create.connect(manage_window)
     orion.events.screen_create.connect(screen.create)
     orion.events.screen_create.connect(manage_screen)
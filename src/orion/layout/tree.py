@@ -290,8 +290,8 @@ class TreeTab(SingleWindow):
         self._panel.handle_Expose = self._panel_Expose
         self._panel.handle_ButtonPress = self._panel_ButtonPress
         self.group.qtile.windowMap[self._panel.window.wid] = self._panel
-        hook.subscribe.window_name_change(self.draw_panel)
-        hook.subscribe.focus_change(self.draw_panel)
+        hook.subscribe.window_name_change(self.draw_panel, deferred=True)
+        hook.subscribe.focus_change(self.draw_panel, deferred=True)
 
     def _panel_Expose(self, e):
         self.draw_panel()
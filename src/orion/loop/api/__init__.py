@@ -0,0 +1 @@
+from interfaces import *
\ No newline at end of file
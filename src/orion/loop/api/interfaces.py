@@ -0,0 +1,9 @@
+from pyutilib.component.core import Interface
+
+class IEventLoop (Interface):
+    """
+        A main loop backend. Every backend provides init(conn), run(),
+        stop(), call_soon(f, *args), call_later(delay, f, *args),
+        run_in_executor(f, *args) and stats(); the asyncio backend also
+        runs coroutines (schedule).
+    """
\ No newline at end of file
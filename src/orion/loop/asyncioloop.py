@@ -0,0 +1,70 @@
+"""
+    Main loop on top of asyncio (trollius on python 2).
+
+    The X connection is watched with loop.add_reader. Plugins get the usual
+    asyncio facilities through orion.loop: timers (call_soon, call_later),
+    coroutines (schedule) and a thread pool (run_in_executor).
+"""
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from pyutilib.component.core import implements, SingletonPlugin
+from api import IEventLoop
+from base import BaseLoop
+
+import logging
+logger = logging.getLogger(__name__)
+
+_ensure_future = getattr(asyncio, 'ensure_future', None) or getattr(asyncio, 'async')
+
+class AsyncioLoop(BaseLoop, SingletonPlugin):
+    implements(IEventLoop)
+
+    def __init__(self):
+        BaseLoop.__init__(self)
+        self.name = 'asyncio'
+        self.loop = None
+
+    def run(self):
+        conn = self.conn
+        loop = self._get_loop()
+        fd = conn.conn.get_file_descriptor()
+        loop.add_reader(fd, self.drain)
+        # events which arrived before the loop started
+        loop.call_soon(self.drain)
+        try:
+            loop.run_forever()
+        finally:
+            loop.remove_reader(fd)
+
+    def stop(self):
+        self.loop.stop()
+
+    def _get_loop(self):
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        return self.loop
+
+    def call_soon(self, f, *args):
+        return self._get_loop().call_soon(self._call, f, args)
+
+    def call_later(self, delay, f, *args):
+        return self._get_loop().call_later(delay, self._call, f, args)
+
+    def schedule(self, coro):
+        """
+            Run a coroutine on the loop and return its future. Requests made
+            by the coroutine are flushed when it finishes; a coroutine which
+            keeps running should wait for a reply or call conn.flush itself.
+        """
+        future = _ensure_future(coro, loop=self._get_loop())
+        future.add_done_callback(lambda f: self.conn.end_cycle())
+        return future
+
+    def run_in_executor(self, f, *args):
+        """
+            Run f in the default thread pool and return a future of its
+            result. f must not talk to the X server.
+        """
+        return self._get_loop().run_in_executor(None, f, *args)
@@ -0,0 +1,109 @@
+import xcb.xproto
+
+import logging
+logger = logging.getLogger(__name__)
+
+class Future(object):
+    """
+        The result of a call run outside of the main loop, for the backends
+        which have no futures of their own. Callbacks added with
+        add_done_callback are called with the future once it is done.
+    """
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def set(self, result, error=None):
+        self._done = True
+        self._result, self._error = result, error
+        callbacks, self._callbacks = self._callbacks, []
+        for f in callbacks:
+            try:
+                f(self)
+            except Exception:
+                logger.exception('future callback %r failed'%(f,))
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        """
+            Return the result, or raise the exception of the call.
+        """
+        if not self._done:
+            raise RuntimeError('result is not ready')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def exception(self):
+        if not self._done:
+            raise RuntimeError('result is not ready')
+        return self._error
+
+    def add_done_callback(self, f):
+        if self._done:
+            f(self)
+        else:
+            self._callbacks.append(f)
+
+
+class BaseLoop(object):
+    """
+        Common part of the main loop backends.
+
+        A wakeup is a call of drain, triggered by the X connection becoming
+        readable. Each drain dispatches all pending events as one batch and
+        sends the requests they produced with a single flush (conn.end_cycle);
+        an idle wakeup is one which found no events to dispatch. Events which
+        reading replies left in xcb's queue do not wake the loop up:
+        conn.end_cycle polls again and dispatches them before returning, at
+        the end of a drain as well as of a scheduled callback.
+    """
+    def __init__(self):
+        self.conn = None
+        self.wakeups = 0
+        self.idle_wakeups = 0
+        self.events = 0
+
+    def init(self, conn):
+        self.conn = conn
+
+    def drain(self):
+        self.wakeups += 1
+        conn = self.conn
+        try:
+            conn.xpoll()
+        # Errors of unchecked requests are routed by xpoll. What gets here
+        # is an error raised by a reply: if a window is created and then
+        # immediately destroyed (before the event handler is evoked), when
+        # the event handler tries to examine the window properties, it
+        # will throw a BadWindow exception. We can essentially ignore it,
+        # since the window is already dead and we've got another event in
+        # the queue notifying us to clean it up.
+        except (xcb.xproto.BadWindow, xcb.xproto.BadAccess), e:
+            logger.debug('%s while handling events'%type(e).__name__)
+        finally:
+            conn.end_cycle()
+        if not conn.last_drain:
+            self.idle_wakeups += 1
+        self.events += conn.last_drain
+
+    def _call(self, f, args):
+        """
+            Run a callback scheduled on the loop and flush whatever requests
+            it made in one go.
+        """
+        try:
+            return f(*args)
+        finally:
+            self.conn.end_cycle()
+
+    def stats(self):
+        return dict(
+            wakeups = self.wakeups,
+            idle_wakeups = self.idle_wakeups,
+            events = self.events,
+        )
@@ -0,0 +1,80 @@
+import gobject, threading
+from pyutilib.component.core import implements, SingletonPlugin
+from api import IEventLoop
+from base import BaseLoop, Future
+
+import logging
+logger = logging.getLogger(__name__)
+
+class GObjectLoop(BaseLoop, SingletonPlugin):
+    """
+        Main loop on top of the default gobject main context.
+    """
+    implements(IEventLoop)
+
+    def __init__(self):
+        BaseLoop.__init__(self)
+        self.name = 'gobject'
+        self.running = False
+        self.iterations = 0
+
+    def run(self):
+        conn = self.conn
+        self.running = True
+        display_tag = gobject.io_add_watch(conn.conn.get_file_descriptor(),
+                                           gobject.IO_IN, self._watch)
+        # events which arrived before the loop started
+        self.drain()
+        try:
+            context = gobject.main_context_default()
+            while self.running:
+                context.iteration(True)
+                self.iterations += 1
+        finally:
+            gobject.source_remove(display_tag)
+
+    def _watch(self, source, cond):
+        self.drain()
+        return True
+
+    def stop(self):
+        self.running = False
+
+    def call_soon(self, f, *args):
+        def callback():
+            self._call(f, args)
+            return False
+        return gobject.idle_add(callback)
+
+    def call_later(self, delay, f, *args):
+        def callback():
+            self._call(f, args)
+            return False
+        return gobject.timeout_add(int(delay * 1000), callback)
+
+    def run_in_executor(self, f, *args):
+        """
+            Run f in a worker thread and return a Future of its result. The
+            result is delivered, and the future's callbacks run, in the main
+            loop. f must not talk to the X server.
+        """
+        future = Future()
+        def deliver(result, error):
+            self._call(future.set, (result, error))
+            return False
+        def work():
+            try:
+                result, error = f(*args), None
+            except Exception, e:
+                result, error = None, e
+            gobject.idle_add(deliver, result, error)
+        gobject.threads_init()
+        t = threading.Thread(target=work, name='orion-executor')
+        t.daemon = True
+        t.start()
+        return future
+
+    def stats(self):
+        d = BaseLoop.stats(self)
+        d['iterations'] = self.iterations
+        return d
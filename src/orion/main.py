@@ -3,6 +3,7 @@ from orion.wm.api import IWindowManager
 from pyutilib.component.core import ExtensionPoint, PluginGlobals
 from orion.accessibility import AccessibilityManager
 from orion.comm.api import IDisplayServerCommunicator
+from orion.loop.api import IEventLoop
 import os
 
 import logging
@@ -14,22 +15,32 @@ class Orion(object):
         
         self.__window_managers = ExtensionPoint(IWindowManager)
         self.__display_servers = ExtensionPoint(IDisplayServerCommunicator)
+        self.__loops = ExtensionPoint(IEventLoop)
+        self.__loop = None
         self.__accessibility_manager = None
         self.__conn = None
         
     
-    def run(self):
+    def init(self):
         Logger('orion', verbose=True)
         
         self.__accessibility_manager = AccessibilityManager()
         
         # load Display Server Communicators
+        server = os.environ.get("ORION_DISPLAY_SERVER", "xorg")
         displayName = os.environ.get("DISPLAY")
-        if not displayName:
+        if server == "xorg" and not displayName and not os.environ.get("ORION_REPLAY"):
             raise 
-        self.__conn = self.__display_servers()[0]
+        self.__conn = self.__display_servers.service(server)
+        logger.debug("using '%s' display server"%server)
         self.__conn.init(displayName)
         
+        # load the main loop
+        loop = os.environ.get("ORION_LOOP", "gobject")
+        self.__loop = self.__loops.service(loop)
+        logger.debug("using '%s' main loop"%loop)
+        self.__loop.init(self.__conn)
+        
         # load window managers
         manager_count = len(self.__window_managers)
         logger.debug('found %s orion window managers'%manager_count)
@@ -38,7 +49,10 @@ class Orion(object):
         manager.init()
         
         self.DEBUG_TEST()
-        
+    
+    def run(self):
+        self.init()
+        manager = self.__window_manager
         logger.debug("starting '%s' window manager"%manager.name)
         manager.run()
         PluginGlobals.pop_env('orion')
@@ -54,6 +68,9 @@ class Orion(object):
     
     @property
     def conn(self): return self.__conn
+    
+    @property
+    def loop(self): return self.__loop
 
 # replace module 'orion' with class Orion
 import orion, sys
@@ -66,4 +83,11 @@ sys.modules['orion'] = orion_inst
 from orion.wm import nebula
 from orion.accessibility.shortcuts import manager
 from orion.comm.xorg import xorg
+from orion.comm.headless import headless
+from orion.loop import gobjectloop
+try:
+    # needs asyncio, or trollius on python 2
+    from orion.loop import asyncioloop
+except ImportError:
+    pass
 #######################
\ No newline at end of file
@@ -1,62 +1,237 @@
-from weakref import ref
+from weakref import ref, WeakSet
 import inspect
-from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Version of the connection graph. Every connect and disconnect bumps it and
+# a signal rebuilds its compiled slot list on the first emission after that.
+_version = [0]
+
+def _changed():
+    _version[0] += 1
+
+# every live Signal, for report
+_signals = WeakSet()
+
 
 class Event(object):
+    """
+        The argument of every slot. Keyword arguments of the emission are
+        plain attributes; one Event is shared by all the slots reached by an
+        emission, only currentTarget changes along the way.
+    """
+    __slots__ = ('target', 'currentTarget', 'args', '__dict__')
+
     def __init__(self, *args, **kwargs):
-        self.__kwargs = kwargs
-        self.__args = args
-            
-    def __getattr__(self, name):
-        return self.__kwargs[name]
-    
-    @property
-    def args(self):
-        return self.__args
-    
+        self.args = args
+        self.target = kwargs.pop('target', None)
+        self.currentTarget = kwargs.pop('currentTarget', self.target)
+        self.__dict__ = kwargs
+
     def copy(self):
-        return Event(*self.args, **self.__kwargs)
-    
+        return Event(*self.args, target=self.target,
+                     currentTarget=self.currentTarget, **self.__dict__)
+
     def __str__(self):
         return 'Event '+str(self.__dict__)
 
 
+def _event(args, target, fields):
+    """
+        Build an Event reusing the fields dict, without going through
+        __init__.
+    """
+    event = Event.__new__(Event)
+    event.args = args
+    event.target = target
+    event.currentTarget = target
+    event.__dict__ = fields
+    return event
+
+
+class DeferredQueue(object):
+    """
+        Calls postponed to the end of the current loop iteration (run is
+        called by the connection's end_cycle, before the requests of the
+        iteration are flushed).
+
+        Calls are merged by key: adding a key which is already pending
+        only replaces its arguments, so the call runs once, with the latest
+        ones, at the position of the first. Lower priorities run first.
+        Calls added while running are run in the same iteration, up to
+        rounds times.
+    """
+    def __init__(self, rounds=10):
+        self.rounds = rounds
+        # key -> [priority, order, f, args, kwargs]
+        self.pending = {}
+        self.order = 0
+        self.added = 0
+        self.merged = 0
+        self.calls = 0
+
+    def add(self, key, f, args=(), kwargs={}, priority=0):
+        self.added += 1
+        entry = self.pending.get(key)
+        if entry is not None:
+            self.merged += 1
+            entry[2:] = [f, args, kwargs]
+            return
+        self.order += 1
+        self.pending[key] = [priority, self.order, f, args, kwargs]
+
+    def run(self):
+        for i in range(self.rounds):
+            if not self.pending:
+                return
+            entries, self.pending = self.pending.values(), {}
+            entries.sort()
+            for priority, order, f, args, kwargs in entries:
+                self.calls += 1
+                try:
+                    f(*args, **kwargs)
+                except Exception:
+                    logger.exception('deferred call of %r failed'%(f,))
+        if self.pending:
+            logger.warning('%s deferred calls left for the next iteration'%
+                           len(self.pending))
+
+    def stats(self):
+        return dict(
+            added = self.added,
+            merged = self.merged,
+            calls = self.calls,
+            pending = len(self.pending),
+        )
+
+deferred = DeferredQueue()
+
+
+class _DeferredSlot(object):
+    """
+        A slot connected with connect_deferred: queues the call of the real
+        slot instead of making it, once per event target.
+    """
+    __slots__ = ('slot', 'priority')
+
+    def __init__(self, slot, priority, callback=None):
+        self.slot = WeakMethod(slot, callback) if inspect.ismethod(slot) else slot
+        self.priority = priority
+
+    def __call__(self, event):
+        # the emission goes on changing the shared event
+        deferred.add((self, event.target), self.slot, (event.copy(),),
+                     priority=self.priority)
+
+
 class Signal(object):
-    def __init__(self):
+    """
+        A list of slots called with an Event.
+
+        Slots are bound methods (held weakly), plain functions and other
+        signals, which forward the event to their own slots. Emission does
+        not walk that graph: it is flattened into a list of (currentTarget,
+        callable) pairs when first emitted after the connections changed.
+
+        defer() postpones an emission to the end of the loop iteration,
+        merging the emissions with the same target; connect_deferred()
+        makes a single slot run at most once per iteration and target.
+    """
+    # of deferred emissions, see DeferredQueue
+    priority = 0
+
+    def __init__(self, name=None):
         #self.current_target = caller
-    
+        self.name = name
+
+        # slot key (see _slot_key) -> WeakMethod
         self.slots = {}
         self.blocked = False #to prevent looped Signals
 
         # for keeping references to _WeakMethod_FuncHost objects.
         # If we didn't, then the weak references would die for
-        # non-method slots that we've created.
+        # non-method slots that we've created. Same keys as slots.
         self.funchost = {}
 
+        self._compiled = None
+        self._compiled_version = -1
+
+        # (key, weakref) of slots whose object died, removed by _compact
+        self._dead = []
+        self._weakself = ref(self)
+        _signals.add(self)
+
     def __call__(self, target=None, *args, **kwargs):
         baseEvent = kwargs.pop('event',None)
         if baseEvent:
-            vardict = vars(baseEvent)
+            vardict = dict(baseEvent.__dict__)
             vardict.update(kwargs)
         else:
             vardict = kwargs
-        event = Event(*args, target=target, currentTarget=target, **vardict)
-        self._call(event)
+        self._call(_event(args, target, vardict))
+
+    def defer(self, target=None, *args, **kwargs):
+        """
+            Emit at the end of the loop iteration. Deferred emissions of
+            this signal with the same target are merged into the last one.
+        """
+        deferred.add((self, target), self, (target,) + args, kwargs,
+                     self.priority)
 
     def chainCall(self, target, event):
         event.currentTarget = target
         self._call(event)
-    
+
     def _call(self, event):
-        if not self.blocked:
-            self.blocked = True
-            for sid, slot in self.slots.iteritems():
-                if slot != None:
-                    slot(event)
+        if self.blocked:
+            return
+        if self._dead:
+            self._compact()
+        if self._compiled_version != _version[0]:
+            self._compile()
+        self.blocked = True
+        try:
+            target = event.currentTarget
+            for current, slot, chain in self._compiled:
+                event.currentTarget = target if current is None else current
+                if chain:
+                    _call_chained(chain, slot, event)
                 else:
-                    del self.slots[sid]
+                    slot(event)
+        finally:
             self.blocked = False
-    
+
+    def _compile(self):
+        out = []
+        self._collect(None, out, set(), ())
+        self._compiled = out
+        self._compiled_version = _version[0]
+
+    def _collect(self, current, out, stack, chain):
+        """
+            Append the (currentTarget, callable, chain) entries this signal
+            calls when reached with current (None: emitted directly) through
+            the chained signals chain. stack holds the signals being
+            expanded, so loops end like they do with blocked.
+        """
+        stack.add(self)
+        for slot in self.slots.itervalues():
+            if isinstance(slot, WeakChainMethod):
+                host = slot.c()
+                if host is not None and host.hostedFunction not in stack:
+                    signal = host.hostedFunction
+                    signal._collect(self, out, stack, chain + (signal,))
+                continue
+            obj = slot.c()
+            if obj is None:
+                continue
+            if isinstance(obj, _WeakMethod_FuncHost):
+                out.append((current, obj.hostedFunction, chain))
+            else:
+                out.append((current, slot, chain))
+        stack.discard(self)
+
     def __iadd__(self, slot):
         self.connect(slot)
         return self
@@ -64,12 +239,43 @@ class Signal(object):
     def __isub__(self, slot):
         self.disconnect(slot)
         return self
-        
+
+    def _reaper(self, key):
+        """
+            The weakref callback of the slot key: queues it for _compact.
+            It only holds a weak reference to the signal.
+        """
+        weakself = self._weakself
+        def reap(wr):
+            signal = weakself()
+            if signal is not None:
+                signal._dead.append((key, wr))
+        return reap
+
+    def _compact(self):
+        """
+            Remove the slots whose object died. Each death is handled
+            once, so the cost is amortised O(1) per dead slot.
+        """
+        dead, self._dead = self._dead, []
+        removed = False
+        for key, wr in dead:
+            slot = self.slots.get(key)
+            # the key may have been reused by a new object since
+            if slot is not None and _slot_ref(slot) is wr:
+                del self.slots[key]
+                self.funchost.pop(key, None)
+                removed = True
+        if removed:
+            _changed()
+
     def connect(self, slot):
+        if self._dead:
+            self._compact()
         self.disconnect(slot)
-        sid = id(slot)
+        sid = _slot_key(slot)
         if inspect.ismethod(slot):
-            wref = WeakMethod(slot)
+            wref = WeakMethod(slot, self._reaper(sid))
         else:
             o = _WeakMethod_FuncHost(slot)
             if isinstance(slot, Signal):
@@ -79,20 +285,78 @@ class Signal(object):
             # we stick a copy in here just to keep the instance alive
             self.funchost[sid] = o
         self.slots[sid] = wref
-            
+        _changed()
+
+    def connect_deferred(self, slot, priority=0):
+        """
+            Connect slot so that it runs at the end of the loop iteration,
+            at most once per event target, with the last event.
+        """
+        if self._dead:
+            self._compact()
+        self.disconnect(slot)
+        sid = _slot_key(slot)
+        o = _WeakMethod_FuncHost(_DeferredSlot(slot, priority, self._reaper(sid)))
+        self.funchost[sid] = o
+        self.slots[sid] = WeakMethod(o.func)
+        _changed()
 
     def disconnect(self, slot):
-        sid = id(slot)
+        sid = _slot_key(slot)
         try:
             del self.slots[sid]
-        except:
-            pass
+        except KeyError:
+            return
+        self.funchost.pop(sid, None)
+        _changed()
 
     def disconnectAll(self):
         del self.slots
         del self.funchost
-        self.slots = OrderedDict()
+        self.slots = {}
         self.funchost = {}
+        self._dead = []
+        _changed()
+
+def _call_chained(chain, slot, event):
+    """
+        Call a slot reached through the chained signals chain. Like the
+        emitting signal, they are blocked while it runs, and it is skipped
+        if one of them is already emitting, so a slot re-emitting a chained
+        signal does not loop.
+    """
+    for signal in chain:
+        if signal.blocked:
+            return
+    for signal in chain:
+        signal.blocked = True
+    try:
+        slot(event)
+    finally:
+        for signal in chain:
+            signal.blocked = False
+
+def _slot_key(slot):
+    """
+        The key of slot in Signal.slots. A bound method is a new object on
+        every attribute access, so it is keyed by its object and function
+        rather than by its id.
+    """
+    if inspect.ismethod(slot) and slot.im_self is not None:
+        return (id(slot.im_self), slot.im_func)
+    return id(slot)
+
+def _slot_ref(slot):
+    """
+        The weakref whose death makes slot dead.
+    """
+    host = slot.c()
+    if isinstance(host, _WeakMethod_FuncHost) and \
+            isinstance(host.hostedFunction, _DeferredSlot):
+        inner = host.hostedFunction.slot
+        if isinstance(inner, WeakMethod):
+            return inner.c
+    return slot.c
 
 class _WeakMethod_FuncHost:
     def __init__(self, func):
@@ -101,49 +365,56 @@ class _WeakMethod_FuncHost:
         self.hostedFunction(*args, **kwargs)
 
 # this class was generously donated by a poster on ASPN (aspn.activestate.com)
-class WeakMethod:
-    def __init__(self, f):
+class WeakMethod(object):
+    __slots__ = ('f', 'c')
+
+    def __init__(self, f, callback=None):
         self.f = f.im_func
-        self.c = ref(f.im_self)
+        self.c = ref(f.im_self, callback)
     def __call__(self, *args, **kwargs):
-        if self.c() == None : return
-        self.f(self.c(), *args, **kwargs)
-        
+        obj = self.c()
+        if obj is not None:
+            self.f(obj, *args, **kwargs)
+
 class WeakChainMethod(WeakMethod):
+    __slots__ = ('target',)
+
     def __init__(self, target, f):
         self.target = target
         WeakMethod.__init__(self, f)
     def __call__(self, event):
         self.c().hostedFunction.chainCall(self.target, event.copy())
- 
- 
+
+
 class SignalGroup(Signal):
+    """
+        A signal with named sub-signals. Emitting a sub-signal also reaches
+        the slots of the group; emitting the group reaches the slots of
+        every sub-signal.
+    """
     def __init__(self, *names):
         Signal.__init__(self)
         self.__signal_names = {}
         self.__signals = {}
+        # sub-signals in the order of names
+        self.__order = []
         for name in names:
             if name not in self.__signal_names:
-                signal = Signal()
+                signal = Signal(name)
                 self.__signal_names[name] = signal
                 self.__signals[signal] = True
+                self.__order.append(signal)
                 setattr(self, name, signal)
                 signal.connect(self)
-                
-    def _call(self, event):
-        if not self.blocked:
-            self.blocked = True
-            if not event.currentTarget in self.__signals:
-                for slot in self.__signals:
-                    slot.chainCall(self, event)
-            for i in range(len(self.slots)):
-                slot = self.slots[i]
-                if slot != None:
-                    slot(event)
-                else:
-                    del self.slots[i]
-            self.blocked = False
-    
+
+    def _collect(self, current, out, stack, chain):
+        if current not in self.__signals:
+            stack.add(self)
+            for signal in self.__order:
+                if signal not in stack:
+                    signal._collect(self, out, stack, chain + (signal,))
+        Signal._collect(self, current, out, stack, chain)
+
     def connect_by_name(self, dst):
         assert isinstance(dst, SignalGroup)
         for name, signal in self.__signal_names.iteritems():
@@ -151,30 +422,135 @@ class SignalGroup(Signal):
                 dst_signal = dst[name]
             except: continue
             signal.connect(dst_signal)
-    
+
     def __getitem__(self, key):
         return self.__signal_names[key]
 
-#### 1
-'''
-a = Signal()
-
-events =[]
-for x in range(0,1000):
-    s = Signal()
-    events.append(s)
-    a.connect(s)
-print 'done'
-#'''
-   
-#### 2
-''' 
-a = Signal()
-b = Signal()
-c = Signal()
-a += b
-b += c 
-for x in range(0,100000):
-    a()
-print 'done'
-#'''
\ No newline at end of file
+
+def _describe(slot):
+    host = slot.c()
+    if host is None:
+        return '<dead>'
+    if isinstance(slot, WeakChainMethod):
+        signal = host.hostedFunction
+        return 'signal %s'%(signal.name or hex(id(signal)))
+    if isinstance(host, _WeakMethod_FuncHost):
+        f = host.hostedFunction
+        if isinstance(f, _DeferredSlot):
+            f = f.slot
+            if isinstance(f, WeakMethod):
+                return 'deferred %s.%s'%(type(f.c()).__name__, f.f.__name__)
+        return '%s.%s'%(getattr(f, '__module__', '?'), getattr(f, '__name__', repr(f)))
+    return '%s.%s'%(type(host).__name__, slot.f.__name__)
+
+def report(limit=20):
+    """
+        Live connections, to find slots which outlive what they were
+        connected for: the number of signals and slots, and the limit
+        signals with the most slots, each with its slots counted by
+        owner (class and method, function or chained signal).
+    """
+    signals = list(_signals)
+    rows = []
+    total = 0
+    for signal in signals:
+        if signal._dead:
+            signal._compact()
+        n = len(signal.slots)
+        total += n
+        if n:
+            rows.append((n, signal))
+    rows.sort(key=lambda r: -r[0])
+    top = []
+    for n, signal in rows[:limit]:
+        owners = {}
+        for slot in signal.slots.itervalues():
+            d = _describe(slot)
+            owners[d] = owners.get(d, 0) + 1
+        top.append(dict(
+            signal = signal.name or hex(id(signal)),
+            slots = n,
+            funchost = len(signal.funchost),
+            owners = owners,
+        ))
+    return dict(
+        signals = len(signals),
+        slots = total,
+        top = top,
+    )
+
+
+class SignalRouter(object):
+    """
+        Signals of many targets: for every signal name, a table of Signals
+        keyed by target id, or by (target id, detail) for subscriptions to
+        a detail of the event such as the atom of a property_notify.
+
+        An emission only looks up the Signals of its own keys, so its cost
+        depends on neither the number of targets nor the subscribers of the
+        other targets.
+
+            router.connect('property_notify', slot, wid, atom)
+            router.emit('property_notify', target, wid, atom, atom=atom)
+    """
+    def __init__(self, *names):
+        self.tables = dict((name, {}) for name in names)
+        # target id -> (name, key) of its signals
+        self.targets = {}
+
+    def signal(self, name, wid, detail=None):
+        """
+            Return the Signal of name for wid and detail, creating it if
+            needed.
+        """
+        table = self.tables[name]
+        key = wid if detail is None else (wid, detail)
+        signal = table.get(key)
+        if signal is None:
+            signal = table[key] = Signal()
+            self.targets.setdefault(wid, set()).add((name, key))
+        return signal
+
+    def connect(self, name, slot, wid, detail=None):
+        self.signal(name, wid, detail).connect(slot)
+
+    def disconnect(self, name, slot, wid, detail=None):
+        table = self.tables[name]
+        key = wid if detail is None else (wid, detail)
+        signal = table.get(key)
+        if signal is None:
+            return
+        signal.disconnect(slot)
+        if signal._dead:
+            signal._compact()
+        if not signal.slots:
+            del table[key]
+            keys = self.targets[wid]
+            keys.discard((name, key))
+            if not keys:
+                del self.targets[wid]
+
+    def forget(self, wid):
+        """
+            Drop every subscription to wid.
+        """
+        for name, key in self.targets.pop(wid, ()):
+            del self.tables[name][key]
+
+    def emit(self, name, target, wid, detail=None, **kwargs):
+        table = self.tables[name]
+        if not table:
+            return
+        if detail is not None:
+            signal = table.get((wid, detail))
+            if signal is not None:
+                signal(target, wid=wid, **kwargs)
+        signal = table.get(wid)
+        if signal is not None:
+            signal(target, wid=wid, **kwargs)
+
+    def stats(self):
+        return dict(
+            targets = len(self.targets),
+            signals = dict((name, len(table)) for name, table in self.tables.iteritems()),
+        )
@@ -1,5 +1,4 @@
 import atexit, sys, os, traceback
-import contextlib
 import gobject
 #import xcbq
 import xcb.xproto, xcb.xinerama
@@ -9,7 +8,9 @@ from orion import utils, hook
 from orion.wm.window import window
 from orion.wm.screen import Screen
 from orion.wm.window.window import Window
+from orion.comm.xorg import dispatch
 from orion.signals import SignalGroup
+from orion import signals
 from pyutilib.component.core import ExtensionPoint
 from orion.comm.api import IDisplayServerCommunicator
 from pyutilib.component.core import implements, SingletonPlugin
@@ -45,6 +46,8 @@ class Group(object):
         self.currentWindow = None
         self.screen = None
         self.currentLayout = None
+        # warp of the pending layoutLater
+        self.layoutWarp = False
 
     def _configure(self, layouts, floating_layout, qtile):
         self.screen = None
@@ -99,7 +102,11 @@ class Group(object):
         moving warp to it.
         """
         if self.screen and len(self.windows):
-            with self.disableMask(xcb.xproto.EventMask.EnterWindow):
+            # windows moving under the pointer are not the user entering them
+            orion.conn.suppressor.ignore(dispatch.EnterNotify)
+            shadow = orion.conn.shadow
+            shadow.begin_relayout()
+            try:
                 normal = [x for x in self.windows if not x.floating]
                 floating = [x for x in self.windows
                     if x.floating and not x.minimized]
@@ -110,6 +117,21 @@ class Group(object):
                     self.floating_layout.layout(floating, screen)
                 if self.currentWindow and self.screen == self.qtile.currentScreen:
                     self.currentWindow.focus(warp)
+            finally:
+                shadow.end_relayout()
+
+    def layoutLater(self, warp=False):
+        """
+            Layout the group once at the end of the loop iteration, however
+            many times this is called until then; it warps if any of the
+            calls asked to.
+        """
+        self.layoutWarp = self.layoutWarp or warp
+        signals.deferred.add((self, 'layoutAll'), self._layoutLater)
+
+    def _layoutLater(self):
+        warp, self.layoutWarp = self.layoutWarp, False
+        self.layoutAll(warp)
 
     def _setScreen(self, screen):
         """
@@ -130,20 +152,13 @@ class Group(object):
 
     def hide(self):
         self.screen = None
-        with self.disableMask(xcb.xproto.EventMask.EnterWindow
-                              |xcb.xproto.EventMask.FocusChange
-                              |xcb.xproto.EventMask.LeaveWindow):
-            for i in self.windows:
-                i.hide()
-            self.layout.hide()
-
-    @contextlib.contextmanager
-    def disableMask(self, mask):
+        suppressor = orion.conn.suppressor
         for i in self.windows:
-            i._disableMask(mask)
-        yield
-        for i in self.windows:
-            i._resetMask()
+            for code in (dispatch.EnterNotify, dispatch.LeaveNotify,
+                         dispatch.FocusIn, dispatch.FocusOut):
+                suppressor.ignore(code, i.wid)
+            i.hide()
+        self.layout.hide()
 
     def focus(self, win, warp):
         """
@@ -395,10 +410,7 @@ class Nebula(SingletonPlugin):
         self.groupMap = {}
         self.groups = []
         
-        # Find the modifier mask for the numlock key, if there is one:
-        nc = orion.conn.keysym_to_keycode(orion.conn.keyboard.keysyms["Num_Lock"])
-        self.numlockMask = orion.conn.keyboard.modmasks[orion.conn.get_modifier(nc)]
-        self.validMask = ~(self.numlockMask | orion.conn.keyboard.modmasks["lock"])
+        self._update_masks()
 
         # Because we only do Xinerama multi-screening, we can assume that the first
         # screen's root is _the_ root.
@@ -419,6 +431,8 @@ class Nebula(SingletonPlugin):
         if config.main:
             config.main(self)
 
+        self._preload_colors()
+
         self.groups += self.config.groups[:]
         for i in self.groups:
             i._configure(config.layouts, config.floating_layout, self)
@@ -463,6 +477,8 @@ class Nebula(SingletonPlugin):
         orion.conn.events.key_press += self.events.key_press
         orion.conn.events.key_release += self.events.key_release
         orion.conn.events.map_request += self.__handle_map_request
+        orion.conn.events.mapping_notify += self.handle_MappingNotify
+        orion.conn.events.outputs_change += self.handle_OutputsChange
         
         self.mouseMap = {}
         for i in self.config.mouse:
@@ -471,9 +487,17 @@ class Nebula(SingletonPlugin):
         self.grabMouse()
         self.scan()
         
+    def _update_masks(self):
+        # Find the modifier mask for the numlock key, if there is one:
+        nc = orion.conn.keysym_to_keycode(orion.conn.keyboard.keysyms["Num_Lock"])
+        self.numlockMask = orion.conn.get_modifier_mask(nc)
+        self.validMask = ~(self.numlockMask | orion.conn.keyboard.modmasks["lock"])
+
     def _process_screens(self):
-        for screen in orion.conn.pseudoscreens:
-            self.screens.append(screen)
+        # pseudoscreen id -> Screen
+        self.pseudoScreenMap = {}
+        for ps in orion.conn.pseudoscreens:
+            self._add_screen(ps)
         if not self.screens:
             s = Screen()
             self.currentScreen = s
@@ -522,48 +546,13 @@ class Nebula(SingletonPlugin):
             
     def mapKey(self, key):
         self.keyMap[(key.keysym, key.modmask&self.validMask)] = key
-        code = orion.conn.keysym_to_keycode(key.keysym)
-        self.root.grab_key(
-            code,
-            key.modmask,
-            True,
-            xcb.xproto.GrabMode.Async,
-            xcb.xproto.GrabMode.Async,
-        )
-        if self.numlockMask:
-            self.root.grab_key(
-                code,
-                key.modmask | self.numlockMask,
-                True,
-                xcb.xproto.GrabMode.Async,
-                xcb.xproto.GrabMode.Async,
-            )
-            self.root.grab_key(
-                code,
-                key.modmask | self.numlockMask | window.proto.ModMasks["lock"],
-                True,
-                xcb.xproto.GrabMode.Async,
-                xcb.xproto.GrabMode.Async,
-            )
+        orion.conn.grabs.add_key(self.root.wid, key.keysym, key.modmask)
 
     def unmapKey(self, key):
         key_index = (key.keysym, key.modmask&self.validMask)
         if not key_index in self.keyMap:
             return
-
-        code = orion.conn.keysym_to_keycode(key.keysym)
-        self.root.ungrab_key(
-            code,
-            key.modmask)
-        if self.numlockMask:
-            self.root.ungrab_key(
-                code,
-                key.modmask | self.numlockMask
-            )
-            self.root.ungrab_key(
-                code,
-                key.modmask | self.numlockMask | window.proto.ModMasks["lock"]
-            )
+        orion.conn.grabs.remove_key(self.root.wid, key.keysym, key.modmask)
         del(self.keyMap[key_index])
 
     def addGroup(self, name):
@@ -590,9 +579,21 @@ class Nebula(SingletonPlugin):
             del(self.groupMap[name])
             hook.fire("delgroup")
 
-    @utils.LRUCache(200)
     def colorPixel(self, name):
-        return orion.conn.screens[0].default_colormap.alloc_color(name).pixel
+        return orion.conn.screens[0].default_colormap.pixel(name)
+
+    def _preload_colors(self):
+        """
+            Resolve the border colours of all layouts up front, so that
+            relayouts never wait for the server.
+        """
+        colors = set()
+        for l in self.config.layouts + [self.config.floating_layout]:
+            for attr in ('border_focus', 'border_normal'):
+                c = getattr(l, attr, None)
+                if isinstance(c, basestring):
+                    colors.add(c)
+        orion.conn.screens[0].default_colormap.preload(colors)
 
     @property
     def currentLayout(self):
@@ -607,20 +608,39 @@ class Nebula(SingletonPlugin):
         return self.currentScreen.group.currentWindow
 
     def scan(self):
+        """
+            Adopt the windows which exist already. The requests for all the
+            children are pipelined: their attributes and states are fetched
+            in one round trip, then everything manage reads is prefetched
+            for the windows to adopt, so the time taken does not grow with
+            the number of windows times the round trip time.
+        """
         _, _, children = self.root.query_tree()
-        for item in children:
-            try:
-                attrs = item.get_attributes()
-                state = item.get_wm_state()
-            except (xcb.xproto.BadWindow, xcb.xproto.BadAccess):
+        with orion.conn.batch() as b:
+            queries = [(
+                item,
+                b.get_attributes(item),
+                b.get_property(item, "WM_STATE",
+                               xcb.xproto.GetPropertyType.Any, unpack='=LL'),
+            ) for item in children]
+
+        adopt = []
+        for item, attrs, state in queries:
+            if attrs.error() or state.error():
                 continue
-
+            attrs, state = attrs.result(), state.result()
             if attrs and attrs.map_state == xcb.xproto.MapState.Unmapped:
                 continue
             if state and state[0] == window.wmState.WITHDRAWN:
                 continue
-            self.manage(item)
-            
+            if attrs and attrs.override_redirect:
+                continue
+            adopt.append((item, attrs))
+
+        for item, attrs in adopt:
+            item.prefetch()
+        for item, attrs in adopt:
+            self.manage(item, attrs)
 
     def unmanage(self, win):
         c = self.windowMap.get(win)
@@ -632,11 +652,19 @@ class Nebula(SingletonPlugin):
                 c.group.remove(c)
             del self.windowMap[win]
 
-    def manage(self, w):
+    def manage(self, w, attrs=None):
         try:
-            attrs = w.get_attributes()
-        except (xcb.xproto.BadWindow, xcb.xproto.BadAccess):
-            return
+            return self._manage(w, attrs)
+        finally:
+            # what was prefetched for manage is only valid now
+            w.drop_prefetched()
+
+    def _manage(self, w, attrs):
+        if attrs is None:
+            try:
+                attrs = w.get_attributes()
+            except (xcb.xproto.BadWindow, xcb.xproto.BadAccess):
+                return
         if attrs and attrs.override_redirect:
             return
         
@@ -657,41 +685,16 @@ class Nebula(SingletonPlugin):
             return self.windowMap[w.wid]
 
     def grabMouse(self):
-        self.root.ungrab_button(None, None)
         for i in self.config.mouse:
             eventmask = EventMask.ButtonPress
             if isinstance(i, Drag):
                 eventmask |= EventMask.ButtonRelease
-            self.root.grab_button(
-                i.button_code,
-                i.modmask,
-                True,
-                eventmask,
-                xcb.xproto.GrabMode.Async,
-                xcb.xproto.GrabMode.Async,
-                )
-            if self.numlockMask:
-                self.root.grab_button(
-                    i.button_code,
-                    i.modmask | self.numlockMask,
-                    True,
-                    eventmask,
-                    xcb.xproto.GrabMode.Async,
-                    xcb.xproto.GrabMode.Async,
-                    )
-                self.root.grab_button(
-                    i.button_code,
-                    i.modmask | self.numlockMask | window.proto.ModMasks["lock"],
-                    True,
-                    eventmask,
-                    xcb.xproto.GrabMode.Async,
-                    xcb.xproto.GrabMode.Async,
-                    )
+            orion.conn.grabs.add_button(self.root.wid, i.button_code,
+                                        i.modmask, eventmask)
 
     def grabKeys(self):
-        self.root.ungrab_key(None, None)
-        for key in self.keyMap.values():
-            self.mapKey(key)
+        # the grab manager only sends what differs from the current grabs
+        orion.conn.grabs.sync()
 
     def get_target_chain(self, ename, e):
         """
@@ -765,30 +768,65 @@ class Nebula(SingletonPlugin):
     def run(self):
 
         #self.server.start()
-        display_tag = gobject.io_add_watch(orion.conn.conn.get_file_descriptor(), gobject.IO_IN, orion.conn.xpoll)
-        try:
-            context = gobject.main_context_default()
-            while True:
-                if context.iteration(True):
-                    try:
-                        # this seems to be crucial part
-                        orion.conn.flush()
-
-                    # Catch some bad X exceptions. Since X is event based, race
-                    # conditions can occur almost anywhere in the code. For
-                    # example, if a window is created and then immediately
-                    # destroyed (before the event handler is evoked), when the
-                    # event handler tries to examine the window properties, it
-                    # will throw a BadWindow exception. We can essentially
-                    # ignore it, since the window is already dead and we've got
-                    # another event in the queue notifying us to clean it up.
-                    except (xcb.xproto.BadWindow, xcb.xproto.BadAccess):
-                        # TODO: add some logging for this?
-                        pass
-                if self._exit:
-                    break
-        finally:
-            gobject.source_remove(display_tag)
+        orion.loop.run()
+
+    def _free_group(self):
+        """
+            Return a group which is not shown on any screen, creating one if
+            needed.
+        """
+        for g in self.groups:
+            if g.screen is None:
+                return g
+        name = str(len(self.groups))
+        while name in self.groupMap:
+            name += "'"
+        g = Group(name)
+        g._configure(self.config.layouts, self.config.floating_layout, self)
+        self.groups.append(g)
+        self.groupMap[name] = g
+        return g
+
+    def _add_screen(self, ps):
+        s = Screen()
+        s._configure(
+            self,
+            len(self.screens),
+            ps.x, ps.y, ps.width, ps.height,
+            self._free_group(),
+        )
+        self.screens.append(s)
+        self.pseudoScreenMap[ps.id] = s
+        return s
+
+    def _remove_screen(self, ps):
+        s = self.pseudoScreenMap.get(ps.id)
+        if s is None or len(self.screens) == 1:
+            # the last screen is kept, and so is its entry
+            return
+        del self.pseudoScreenMap[ps.id]
+        group, s.group = s.group, None
+        if group is not None:
+            group._setScreen(None)
+        self.screens.remove(s)
+        for i, scr in enumerate(self.screens):
+            scr.index = i
+        if self.currentScreen is s:
+            self.currentScreen = self.screens[0]
+
+    def handle_OutputsChange(self, e):
+        """
+            Monitors were added, removed or changed. Only the affected screens
+            are touched, and only their groups are laid out again.
+        """
+        for ps in e.added:
+            self._add_screen(ps)
+        for ps in e.removed:
+            self._remove_screen(ps)
+        for ps in e.changed:
+            s = self.pseudoScreenMap.get(ps.id)
+            if s is not None:
+                s.resize(ps.x, ps.y, ps.width, ps.height)
 
     def find_screen(self, x, y):
         """
@@ -868,7 +906,7 @@ class Nebula(SingletonPlugin):
         subprocess.Popen('gnome-terminal')
         return
         '''
-        keysym = orion.conn.code_to_syms[e.detail][0]
+        keysym = orion.conn.keycode_to_keysym(e.detail, 0)
         state = e.state
         if self.numlockMask:
             state = e.state | self.numlockMask
@@ -958,6 +996,9 @@ class Nebula(SingletonPlugin):
         """
             Handle xrandr events.
         """
+        if orion.conn.outputs_notify:
+            # monitor changes are reported by outputs_change
+            return
         screen = self.currentScreen
         if e.window == self.root.wid and e.width != screen.width and e.height != screen.height:
             screen.resize(0, 0, e.width, e.height)
@@ -983,12 +1024,15 @@ class Nebula(SingletonPlugin):
         w.configure(**args)
 
     def handle_MappingNotify(self, e):
-        orion.conn.refresh_keymap()
-        if e.request == xcb.xproto.Mapping.Keyboard:
-            self.grabKeys()
+        # the keymap and the grabs are already updated by the communicator
+        if e.request == xcb.xproto.Mapping.Modifier:
+            self._update_masks()
 
     def __handle_map_request(self, e):
         w = Window(orion.conn, e.wid)
+        if not e.wid in self.windowMap:
+            # everything manage reads arrives in one round trip
+            w.prefetch(attributes=True)
         c = self.manage(w)
         if c and (not c.group or not c.group.screen):
             return
@@ -1203,7 +1247,7 @@ class Nebula(SingletonPlugin):
         keysym = keyboard.keysyms.get(key)
         if keysym is None:
             raise command.CommandError("Unknown key: %s"%key)
-        keycode = orion.conn.first_sym_to_code[keysym]
+        keycode = orion.conn.keysym_to_keycode(keysym)
         class DummyEv:
             pass
 
@@ -1250,6 +1294,64 @@ class Nebula(SingletonPlugin):
         """
         orion.conn.flush()
 
+    def cmd_flush_stats(self):
+        """
+            Return the flush counters of the connection: cycles, flushes
+            (including those forced by reading replies), flushes per cycle
+            and a flushes per cycle histogram.
+        """
+        return orion.conn.flush_stats()
+
+    def cmd_property_stats(self):
+        """
+            Return the hit, miss and invalidation counters of the window
+            property cache.
+        """
+        return orion.conn.properties.stats()
+
+    def cmd_shadow_stats(self):
+        """
+            Return how many configure, attribute and map requests were sent
+            and how many were dropped as redundant, overall and for the last
+            relayout.
+        """
+        return orion.conn.shadow.stats()
+
+    def cmd_suppress_stats(self):
+        """
+            Return the number of marker requests sent and of events dropped
+            as caused by our own requests.
+        """
+        return orion.conn.suppressor.stats()
+
+    def cmd_error_stats(self):
+        """
+            Return the X errors of unchecked requests per error type and
+            per error type and operation.
+        """
+        return orion.conn.errors.stats()
+
+    def cmd_deferred_stats(self):
+        """
+            Return how many calls were deferred to the end of a loop
+            iteration, how many of them were merged and how many ran.
+        """
+        return signals.deferred.stats()
+
+    def cmd_hook_stats(self):
+        """
+            Return, per hook, the number of fires, the number of
+            subscribers, the time they took in total and the slowest one.
+        """
+        return hook.stats()
+
+    def cmd_signal_report(self, limit=20):
+        """
+            Return the number of live signals and slots and the signals
+            with the most slots, by owner.
+        """
+        return signals.report(limit)
+
     def cmd_to_screen(self, n):
         """
             Warp focus to screen n, where n is a 0-based screen number.
@@ -1297,6 +1399,7 @@ class Nebula(SingletonPlugin):
             Quit Qtile.
         """
         self._exit = True
+        orion.loop.stop()
 
     def cmd_togroup(self, prompt="group: ", widget="prompt"):
         """
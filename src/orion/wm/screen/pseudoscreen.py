@@ -3,5 +3,15 @@ class PseudoScreen:
         This may be a Xinerama screen or a RandR CRTC, both of which are
         rectagular sections of an actual Screen.
     """
-    def __init__(self, x, y, width, height):
-        self.x, self.y, self.width, self.height = x, y, width, height
\ No newline at end of file
+    def __init__(self, x, y, width, height, id=None, outputs=()):
+        self.x, self.y, self.width, self.height = x, y, width, height
+        # CRTC (RandR) or screen number (Xinerama)
+        self.id = id
+        self.outputs = list(outputs)
+
+    def geometry(self):
+        return self.x, self.y, self.width, self.height
+
+    def __repr__(self):
+        return '<%s %s %d,%d %d,%d>' % (self.__class__.__name__, self.id,
+            self.x, self.y, self.width, self.height)
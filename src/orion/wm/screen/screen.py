@@ -3,26 +3,6 @@ from orion import utils
 
 
 
-class Colormap:
-    def __init__(self, conn, cid):
-        self.conn, self.cid = conn, cid
-
-    def alloc_color(self, color):
-        """
-            Flexible color allocation.
-        """
-        if color.startswith("#"):
-            if len(color) != 7:
-                raise ValueError("Invalid color: %s"%color)
-            def x8to16(i):
-                return 0xffff * (i&0xff)/0xff
-            r = x8to16(int(color[1] + color[2], 16))
-            g = x8to16(int(color[3] + color[4], 16))
-            b = x8to16(int(color[5] + color[6], 16))
-            return self.conn.conn.core.AllocColor(self.cid, r, g, b).reply()
-        else:
-            return self.conn.conn.core.AllocNamedColor(self.cid, len(color), color).reply()
-        
 class ScreenRect(object):
 
     def __init__(self, x, y, width, height):
@@ -172,10 +152,10 @@ class Screen(object):
             return getattr(self, sel)
 
     def resize(self, x=None, y=None, w=None, h=None):
-        x = x or self.x
-        y = y or self.y
-        w = w or self.width
-        h = h or self.height
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        w = self.width if w is None else w
+        h = self.height if h is None else h
         self._configure(self.qtile, self.index, x, y, w, h, self.group)
         for bar in [self.top, self.bottom, self.left, self.right]:
             if bar:
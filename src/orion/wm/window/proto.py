@@ -73,4 +73,52 @@ PropertyMap = {
     "WM_STATE"                  : ("WM_STATE",      32),
     # Qtile-specific properties
     "QTILE_INTERNAL"            : ("CARDINAL",      32)
-}
\ No newline at end of file
+}
+
+# Atoms interned up front, in addition to WindowTypes, WindowStates and the
+# names and types in PropertyMap.
+EWMHAtoms = [
+    "_NET_SUPPORTED",
+    "_NET_SUPPORTING_WM_CHECK",
+    "_NET_WM_NAME",
+    "_NET_WM_VISIBLE_NAME",
+    "_NET_WM_ICON_NAME",
+    "_NET_WM_PID",
+    "_NET_WM_STATE",
+    "_NET_WM_STATE_MODAL",
+    "_NET_WM_STATE_STICKY",
+    "_NET_WM_STATE_MAXIMIZED_VERT",
+    "_NET_WM_STATE_MAXIMIZED_HORZ",
+    "_NET_WM_STATE_SHADED",
+    "_NET_WM_STATE_SKIP_TASKBAR",
+    "_NET_WM_STATE_SKIP_PAGER",
+    "_NET_WM_STATE_HIDDEN",
+    "_NET_WM_STATE_FULLSCREEN",
+    "_NET_WM_STATE_ABOVE",
+    "_NET_WM_STATE_BELOW",
+    "_NET_WM_STATE_DEMANDS_ATTENTION",
+    "_NET_WM_WINDOW_TYPE",
+    "_NET_WM_WINDOW_OPACITY",
+    "_NET_WM_DESKTOP",
+    "_NET_WM_STRUT",
+    "_NET_WM_STRUT_PARTIAL",
+    "_NET_WM_USER_TIME",
+    "_NET_ACTIVE_WINDOW",
+    "_NET_CLIENT_LIST",
+    "_NET_CLIENT_LIST_STACKING",
+    "_NET_CURRENT_DESKTOP",
+    "_NET_NUMBER_OF_DESKTOPS",
+    "_NET_DESKTOP_NAMES",
+    "_NET_DESKTOP_GEOMETRY",
+    "_NET_WORKAREA",
+    "_NET_CLOSE_WINDOW",
+    "UTF8_STRING",
+    # ICCCM
+    "WM_PROTOCOLS",
+    "WM_DELETE_WINDOW",
+    "WM_TAKE_FOCUS",
+    "WM_STATE",
+    "WM_CHANGE_STATE",
+    "WM_WINDOW_ROLE",
+    "WM_CLIENT_LEADER",
+]
@@ -14,6 +14,11 @@ from icccm import wmState
 import icccm
 from xcb.xproto import CW
 from orion.signals import SignalGroup
+from orion.comm.xorg import dispatch
+
+import logging
+logger = logging.getLogger(__name__)
+
 # float states
 floatStates = enum(
         'NOT_FLOATING',
@@ -68,6 +73,13 @@ class _BaseWindow(object):
         self.hidden = True
         self.group = None
         self.name = "<no name>"
+
+    @property
+    def qtile(self):
+        """
+            The window manager, through the group of the window.
+        """
+        return self.group.qtile if self.group else None
     
     def xx(self):
         self.set_attribute(eventmask=self._windowMask)
@@ -88,7 +100,7 @@ class _BaseWindow(object):
         self.borderwidth = 0
         self.bordercolor = None
         self.state = wmState.NORMAL
-        self.window_type = "normal"
+        self.window_type = self.get_wm_type() or "normal"
         self._float_state = floatStates.NOT_FLOATING
 
         self.hints = {
@@ -166,7 +178,7 @@ class _BaseWindow(object):
             hook.fire('client_urgent_hint_changed', self)
 
         if getattr(self, 'group', None):
-            self.group.layoutAll()
+            self.group.layoutLater()
 
         return
 
@@ -265,8 +277,8 @@ class _BaseWindow(object):
 
     def hide(self):
         # We don't want to get the UnmapNotify for this unmap
-        with self.disableMask(xcb.xproto.EventMask.StructureNotify):
-            self.unmap()
+        self.conn.suppressor.ignore(dispatch.UnmapNotify, self.wid)
+        self.unmap()
         self.hidden = True
 
     def unhide(self):
@@ -431,17 +443,56 @@ class Window(_BaseWindow):
                   EventMask.PropertyChange |\
                   EventMask.EnterWindow |\
                   EventMask.FocusChange
+
+    # The manage bundle: the properties read while a window is managed, by
+    # the manage path, floating rules and layouts, as (property, type)
+    # pairs matching the getters. prefetch requests them all at once.
+    _manageProperties = [
+        ("_NET_WM_VISIBLE_NAME", xcb.xproto.GetPropertyType.Any),
+        ("_NET_WM_NAME", xcb.xproto.GetPropertyType.Any),
+        (xcb.xproto.Atom.WM_NAME, xcb.xproto.GetPropertyType.Any),
+        ("WM_HINTS", xcb.xproto.GetPropertyType.Any),
+        ("WM_NORMAL_HINTS", xcb.xproto.GetPropertyType.Any),
+        ("WM_STATE", xcb.xproto.GetPropertyType.Any),
+        ("WM_PROTOCOLS", xcb.xproto.GetPropertyType.Any),
+        ("WM_CLASS", "STRING"),
+        ("WM_WINDOW_ROLE", "STRING"),
+        ("WM_TRANSIENT_FOR", "WINDOW"),
+        ("_NET_WM_WINDOW_TYPE", "ATOM"),
+        ("_NET_WM_STATE", "ATOM"),
+        ("_NET_WM_WINDOW_OPACITY", None),
+    ]
     
+    # properties handle_PropertyNotify acts on
+    HANDLED_PROPERTIES = (
+        "WM_HINTS",
+        "WM_NAME",
+        "_NET_WM_NAME",
+        "_NET_WM_VISIBLE_NAME",
+        "_NET_WM_STATE",
+        "_NET_WM_USER_TIME",
+    )
+
     def xxx(self):
         self.xx()
         self.update_name()
 
+        for name in self.HANDLED_PROPERTIES:
+            self.conn.subscribe('property_notify', self.handle_PropertyNotify,
+                                self.wid, name)
+        self.conn.subscribe('configure_request', self.handle_ConfigureRequest,
+                            self.wid)
+
         # add window to the save-set, so it gets mapped when qtile dies
-        orion.conn.conn.core.ChangeSaveSet(SetMode.Insert, self.wid)
+        c = self.conn.conn.core.ChangeSaveSet(SetMode.Insert, self.wid)
+        self.conn.errors.track(c, self.wid, 'ChangeSaveSet')
     
     def __init__(self, conn, wid):
         _BaseWindow.__init__(self)
         self.conn, self.wid = conn, wid
+        # requests sent by prefetch, read by the next getter call
+        self._geometry_cookie = None
+        self._attributes_cookie = None
         
         self.events = SignalGroup(
             'create',        
@@ -456,9 +507,6 @@ class Window(_BaseWindow):
             'configure_notify',  
             'focus',      
         )
-        
-        self.events.property_notify.connect(self.handle_PropertyNotify)
-        self.events.configure_request.connect(self.handle_ConfigureRequest)
         #self.on_mouse_enter.connect(self.handle_EnterNotify)
 
     def _propertyString(self, r):
@@ -474,11 +522,12 @@ class Window(_BaseWindow):
 #        self.conn.conn.core.KillClient(self.wid)
 
     def set_input_focus(self):
-        self.conn.conn.core.SetInputFocus(
+        c = self.conn.conn.core.SetInputFocus(
             xcb.xproto.InputFocus.PointerRoot,
             self.wid,
             xcb.xproto.Time.CurrentTime
         )
+        self.conn.errors.track(c, self.wid, 'SetInputFocus')
 
 #    def warp_pointer(self, x, y):
 #        self.conn.conn.core.WarpPointer(
@@ -555,39 +604,38 @@ class Window(_BaseWindow):
                 win_gravity = l[9+4],
             )
 
-#    def get_wm_protocols(self):
-#        r = self.get_property("WM_PROTOCOLS", xcb.xproto.GetPropertyType.Any)
-#        if r:
-#            data = struct.pack("B" * len(r.value), *(list(r.value)))
-#            l = struct.unpack_from("=" + "L"*r.value_len, data)
-#            return set([self.conn.atoms.get_name(i) for i in l])
-#        else:
-#            return set()
+    def get_wm_protocols(self):
+        r = self.get_property("WM_PROTOCOLS", xcb.xproto.GetPropertyType.Any)
+        if r:
+            l = struct.unpack_from("=" + "L"*r.value_len, r.value.buf())
+            return set(self.conn.atoms.get_names(l))
+        else:
+            return set()
 
     def get_wm_state(self):
         r = self.get_property("WM_STATE", xcb.xproto.GetPropertyType.Any)
         if r:
             return struct.unpack('=LL', r.value.buf())
 
-#    def get_wm_class(self):
-#        """
-#            Return an (instance, class) tuple if WM_CLASS exists, or None.
-#        """
-#        r = self.get_property("WM_CLASS", "STRING")
-#        if r:
-#            s = self._propertyString(r)
-#            return tuple(s.strip("\0").split("\0"))
+    def get_wm_class(self):
+        """
+            Return an (instance, class) tuple if WM_CLASS exists, or None.
+        """
+        r = self.get_property("WM_CLASS", "STRING")
+        if r:
+            s = self._propertyString(r)
+            return tuple(s.strip("\0").split("\0"))
+
+    def get_wm_window_role(self):
+        r = self.get_property("WM_WINDOW_ROLE", "STRING")
+        if r:
+            return self._propertyString(r)
+
+    def get_wm_transient_for(self):
+        r = self.get_property("WM_TRANSIENT_FOR", "WINDOW", unpack="=L")
+        if r:
+            return r[0]
 
-#    def get_wm_window_role(self):
-#        r = self.get_property("WM_WINDOW_ROLE", "STRING")
-#        if r:
-#            return self._propertyString(r)
-#
-#    def get_wm_transient_for(self):
-#        r = self.get_property("WM_TRANSIENT_FOR", "ATOM")
-#        if r:
-#            return list(r.value)
-#
 #    def get_wm_icon_name(self):
 #        r = self.get_property("WM_ICON_NAME", "UTF8_STRING")
 #        if r:
@@ -599,8 +647,35 @@ class Window(_BaseWindow):
 #            return self._propertyString(r)
 #
     def get_geometry(self):
-        q = self.conn.conn.core.GetGeometry(self.wid)
+        q = self._geometry_cookie or self.conn.conn.core.GetGeometry(self.wid)
+        self._geometry_cookie = None
         return q.reply()
+
+    def prefetch(self, properties=None, attributes=False):
+        """
+            Select our events on the window and request its geometry,
+            optionally its attributes, and properties (by default the manage
+            bundle) without waiting for the replies. The getters read them
+            later, so everything arrives in a single round trip, however
+            many windows are prefetched.
+        """
+        self.set_attribute(eventmask=self._windowMask)
+        core = self.conn.conn.core
+        if attributes:
+            self._attributes_cookie = core.GetWindowAttributes(self.wid)
+        self._geometry_cookie = core.GetGeometry(self.wid)
+        if properties is None:
+            properties = self._manageProperties
+        self.conn.properties.prefetch(self, properties)
+
+    def drop_prefetched(self):
+        """
+            Forget the geometry and attributes requested by prefetch which
+            no getter read, so later getters ask the server again.
+        """
+        cookies = [q for q in (self._geometry_cookie, self._attributes_cookie) if q]
+        self._geometry_cookie = self._attributes_cookie = None
+        self.conn.properties.drop(cookies)
 #
 #    def get_wm_desktop(self):
 #        r = self.get_property("_NET_WM_DESKTOP", "CARDINAL")
@@ -626,12 +701,28 @@ class Window(_BaseWindow):
         """
             Arguments can be: x, y, width, height, border, sibling, stackmode
         """
+        kwargs = self.conn.shadow.configure(self.wid, kwargs)
+        if kwargs is None:
+            # the window is already configured that way
+            return None
         mask, values = ConfigureMasks(**kwargs)
-        return self.conn.conn.core.ConfigureWindow(self.wid, mask, values)
+        c = self.conn.conn.core.ConfigureWindow(self.wid, mask, values)
+        self.conn.errors.track(c, self.wid, 'ConfigureWindow')
+        return c
 
     def set_attribute(self, **kwargs):
-        mask, values = AttributeMasks(**kwargs)
-        self.conn.conn.core.ChangeWindowAttributesChecked(self.wid, mask, values)
+        eventmask = kwargs.get('eventmask')
+        kwargs = self.conn.shadow.attributes(self.wid, kwargs)
+        if kwargs is not None:
+            mask, values = AttributeMasks(**kwargs)
+            c = self.conn.conn.core.ChangeWindowAttributes(self.wid, mask, values)
+            self.conn.errors.track(c, self.wid, 'ChangeWindowAttributes')
+        if eventmask is not None:
+            # properties can only be cached while we hear about changes
+            if eventmask & EventMask.PropertyChange:
+                self.conn.properties.watch(self.wid)
+            else:
+                self.conn.properties.forget(self.wid)
 
     def set_property(self, name, value, type=None, format=None):
         """
@@ -671,34 +762,56 @@ class Window(_BaseWindow):
         # can have a different associated size.
         #  - value is a string of bytes.
         #  - length is the length of the data in terms of the specified format.
-        self.conn.conn.core.ChangeProperty(
+        atom = self.conn.atoms[name]
+        self.conn.properties.invalidate(self.wid, atom)
+        c = self.conn.conn.core.ChangeProperty(
             xcb.xproto.PropMode.Replace,
             self.wid,
-            self.conn.atoms[name],
+            atom,
             self.conn.atoms[type],
             format,  # Format - 8, 16, 32
             length,
             buf
         )
+        self.conn.errors.track(c, self.wid, 'ChangeProperty')
 
     def get_property(self, prop, type=None, unpack=None):
         """
             Return the contents of a property as a GetPropertyReply, or
             a tuple of values if unpack is specified, which is a format
-            string to be used with the struct module.
+            string to be used with the struct module. Replies are cached
+            until the property changes, see PropertyCache.
+        """
+        return self._property_value(
+            self.conn.properties.get(self, prop, type), unpack
+        )
+
+    def _property_atoms(self, prop, type=None):
+        """
+            Return the (property, type) atoms of a property request.
         """
         if type is None:
             if not prop in proto.PropertyMap:
                 raise ValueError, "Must specify type for unknown property."
             else:
                 type, _ = proto.PropertyMap[prop]
-        r = self.conn.conn.core.GetProperty(
-            False, self.wid,
+        return (
             self.conn.atoms[prop] if isinstance(prop, basestring) else prop,
             self.conn.atoms[type] if isinstance(type, basestring) else type,
-            0, (2**32)-1
-        ).reply()
+        )
+
+    def _property_request(self, atom, type):
+        return self.conn.conn.core.GetProperty(
+            False, self.wid, atom, type, 0, (2**32)-1
+        )
 
+    def _property_cookie(self, prop, type=None):
+        """
+            Send the GetProperty request without waiting for the reply.
+        """
+        return self._property_request(*self._property_atoms(prop, type))
+
+    def _property_value(self, r, unpack=None):
         if not r.value_len:
             return None
         elif unpack is not None:
@@ -711,13 +824,19 @@ class Window(_BaseWindow):
 #        return [self.conn.atoms.get_name(i) for i in r.atoms]
 
     def map(self):
-        self.conn.conn.core.MapWindow(self.wid)
+        if self.conn.shadow.map(self.wid, True):
+            c = self.conn.conn.core.MapWindow(self.wid)
+            self.conn.errors.track(c, self.wid, 'MapWindow')
 
     def unmap(self):
-        self.conn.conn.core.UnmapWindow(self.wid)
+        if self.conn.shadow.map(self.wid, False):
+            c = self.conn.conn.core.UnmapWindow(self.wid)
+            self.conn.errors.track(c, self.wid, 'UnmapWindow')
 
     def get_attributes(self):
-        return self.conn.conn.core.GetWindowAttributes(self.wid).reply()
+        q = self._attributes_cookie or self.conn.conn.core.GetWindowAttributes(self.wid)
+        self._attributes_cookie = None
+        return q.reply()
 #
 #    def create_gc(self, **kwargs):
 #        gid = self.conn.conn.generate_id()
@@ -1008,11 +1127,11 @@ class Window(_BaseWindow):
 
         try:
 
-            cliclass = self.window.get_wm_class()
+            cliclass = self.get_wm_class()
             if wmclass and cliclass and wmclass in cliclass:
                 return True
 
-            clirole = self.window.get_wm_window_role()
+            clirole = self.get_wm_window_role()
             if role and clirole and role == clirole:
                 return True
 
@@ -1024,10 +1143,10 @@ class Window(_BaseWindow):
     def handle_event(self, e):
         print '>>> %s'%e.name
         if e.name == 'KeyPressEvent':
-            keycode = self.conn.code_to_syms[e.detail][0]
+            keycode = self.conn.keycode_to_keysym(e.detail, 0)
             self.on_key_press(keycode=keycode, state=e.state, event=e)
         elif e.name == 'KeyReleaseEvent':
-            keycode = self.conn.code_to_syms[e.detail][0]
+            keycode = self.conn.keycode_to_keysym(e.detail, 0)
             self.on_key_release(keycode=keycode, state=e.state, event=e)
         elif e.name == 'MapRequestEvent':
             self.on_map_request(event=e)
@@ -1059,7 +1178,8 @@ class Window(_BaseWindow):
         '''
         FIXME: w okienku bedacym root, ponizsza obsluga jest niepotrzebna!
         '''
-        if self.qtile._drag and self.qtile.currentWindow == self:
+        qtile = self.qtile
+        if qtile and qtile._drag and self.group.currentWindow == self:
             # ignore requests while user is dragging window
             return
         if getattr(self, 'floating', False):
@@ -1086,7 +1206,7 @@ class Window(_BaseWindow):
         return False
 
     def handle_PropertyNotify(self, e):
-        name = self.qtile.conn.atoms.get_name(e.atom)
+        name = self.conn.atoms.get_name(e.atom)
         if name == "WM_TRANSIENT_FOR":
             pass
         elif name == "WM_HINTS":
@@ -1106,12 +1226,12 @@ class Window(_BaseWindow):
         elif name == "WM_PROTOCOLS":
             pass
         elif name == "_NET_WM_USER_TIME":
-            if not self.qtile.config.follow_mouse_focus and \
+            if self.group and not self.qtile.config.follow_mouse_focus and \
                             self.group.currentWindow != self:
                 self.group.focus(self, False)
 
-        elif self.qtile.debug:
-            print >> sys.stderr, "Unknown window property: ", name
+        else:
+            logger.debug("Unknown window property: %s"%name)
         return False
 
     def _items(self, name):